@@ -0,0 +1,319 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+Benchmarks, run headlessly. Each benchmark is a function that does its setup
+and returns the callable to be timed.
+
+Each benchmark reports its best time and the peak memory allocated by a single
+call. Results can be saved as a baseline, and later runs compared against it,
+flagging anything that has got slower.
+"""
+
+from __future__ import division
+
+import os
+import sys
+import json
+import argparse
+from timeit import repeat
+from random import Random
+from random import uniform
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+	import resource
+
+import pyglet
+pyglet.options["shadow_window"] = False
+
+import generation
+from pymunk import Space
+from physics import Size
+from physics import Vector
+from physics import VectorArray
+from physics import PhysicsConfig
+from entities import Stars
+from entities import Strut
+from entities import Umbilical
+from entities import Joints
+from entities import Asteroid
+from entities import Person
+from entities import Crowd
+
+BENCHMARKS = []
+
+def benchmark(name, number=10):
+	"""Register a benchmark under the given name. Names are dotted so related
+	benchmarks can be picked out together.
+	"""
+	def register(f):
+		BENCHMARKS.append((name, number, f))
+		return f
+	return register
+
+def points(n):
+	return [Vector(uniform(-1000, 1000), uniform(-1000, 1000)) for _ in range(n)]
+
+N = 10000
+SIZES = 1000, 3000, 6000
+BASELINE = "benchmark.json"
+
+@benchmark("vector.add.objects")
+def vector_add_objects():
+	a, b = points(N), points(N)
+	return lambda: [x+y for x, y in zip(a, b)]
+
+@benchmark("vector.add.array")
+def vector_add_array():
+	a, b = VectorArray.from_vectors(points(N)), VectorArray.from_vectors(points(N))
+	return lambda: a+b
+
+@benchmark("vector.sub.objects")
+def vector_sub_objects():
+	a, b = points(N), points(N)
+	return lambda: [x-y for x, y in zip(a, b)]
+
+@benchmark("vector.sub.array")
+def vector_sub_array():
+	a, b = VectorArray.from_vectors(points(N)), VectorArray.from_vectors(points(N))
+	return lambda: a-b
+
+@benchmark("vector.scale.objects")
+def vector_scale_objects():
+	a = points(N)
+	return lambda: [x*2.5 for x in a]
+
+@benchmark("vector.scale.array")
+def vector_scale_array():
+	a = VectorArray.from_vectors(points(N))
+	return lambda: a*2.5
+
+@benchmark("vector.magnitude.objects")
+def vector_magnitude_objects():
+	a = points(N)
+	return lambda: [x.magnitude for x in a]
+
+@benchmark("vector.magnitude.array")
+def vector_magnitude_array():
+	a = VectorArray.from_vectors(points(N))
+	return lambda: a.magnitude
+
+@benchmark("vector.normalise.objects")
+def vector_normalise_objects():
+	a = points(N)
+	return lambda: [x*(1/x.magnitude) for x in a]
+
+@benchmark("vector.normalise.array")
+def vector_normalise_array():
+	a = VectorArray.from_vectors(points(N))
+	return lambda: a.normalised()
+
+@benchmark("vector.closest.objects")
+def vector_closest_objects():
+	a = points(N)
+	target = Vector(0, 0)
+	return lambda: target.closest(a)
+
+@benchmark("vector.closest.array")
+def vector_closest_array():
+	a = VectorArray.from_vectors(points(N))
+	target = Vector(0, 0)
+	return lambda: a.closest(target)
+
+for size in SIZES:
+	def generation_split(size=size):
+		return lambda: list(generation.Segment(size, size).recursive_split(175, Random(0)))
+	benchmark("generation.split."+str(size))(generation_split)
+
+	def generation_populate(size=size):
+		return lambda: Asteroid.populate(50, 100, Size(size, size), None, None, Space(), seed=0)
+	benchmark("generation.populate."+str(size), number=1 if size > 3000 else 3)(generation_populate)
+
+	def stars(size=size):
+		def construct():
+			Stars.clear_cache()
+			return Stars(Size(size, size), None, None, seed=0)
+		return construct
+	benchmark("stars."+str(size))(stars)
+
+def people(n):
+	space = Space()
+	crowd = [Person(uniform(0, 3000), uniform(0, 3000), None, None, space) for _ in range(n)]
+	for person in crowd:
+		person.target = 1500, 3000
+	return crowd
+
+@benchmark("crowd.update.objects")
+def crowd_update_objects():
+	crowd = people(1000)
+	def update():
+		for person in crowd:
+			person.update()
+	return update
+
+@benchmark("crowd.update.array")
+def crowd_update_array():
+	crowd = Crowd(people(1000))
+	return crowd.update
+
+def belt(world_size, config=None, seed=0, settle=60, drifting=True):
+	"""A space full of asteroids, set drifting, as Main would have it.
+
+	:param config: The :class:`physics.PhysicsConfig` for the space, if any.
+	:param settle: How many steps to take first, to get things into the
+	               state they'd be in mid-game.
+	:param drifting: False leaves every asteroid at rest, as a settled belt.
+	:return: The space and the asteroids in it.
+	"""
+	space = Space()
+	layout = generation.layout(world_size, 50, 100, seed, processes=1)
+	if config:
+		config.apply(space)
+	asteroids = Asteroid.build(layout, None, None, space)
+	if not drifting:
+		for asteroid in asteroids:
+			asteroid.body.velocity = 0, 0
+	for _ in range(settle):
+		space.step(1/60)
+	return space, asteroids
+
+def join(kind, asteroids, space, m):
+	"""Join up to ``m`` pairs of neighbouring asteroids, centre to centre."""
+	neighbours = sorted(asteroids, key=lambda asteroid: asteroid.body.position.x)
+	return [kind(a, b, (0, 0), (0, 0), space) for a, b in zip(neighbours[:m], neighbours[1:m+1])]
+
+# Big enough for the presets to make a difference, and settled for long enough
+# for idle bodies to have gone to sleep.
+PRESET_BELT = Size(24000, 24000)
+
+for drifting in (True, False):
+	def physics_step_default(drifting=drifting):
+		space, asteroids = belt(PRESET_BELT, settle=600, drifting=drifting)
+		return lambda: space.step(1/60)
+	benchmark("physics.step.default" if drifting else "physics.step.default.settled")(physics_step_default)
+
+for preset in sorted(PhysicsConfig.PRESETS):
+	def physics_step_preset(preset=preset):
+		# The settled preset is for belts that have come to rest.
+		drifting = preset != "settled"
+		config = PhysicsConfig.for_asteroids(50, 100, 6000, preset)
+		space, asteroids = belt(PRESET_BELT, config, settle=600, drifting=drifting)
+		return lambda: space.step(1/60)
+	benchmark("physics.step."+preset)(physics_step_preset)
+
+for size in SIZES:
+	for m in (0, 100, 500):
+		def physics_step_struts(size=size, m=m):
+			space, asteroids = belt(Size(size, size))
+			join(Strut, asteroids, space, m)
+			return lambda: space.step(1/60)
+		benchmark("physics.step.struts."+str(size)+"."+str(m))(physics_step_struts)
+
+for kind in (Strut, Umbilical):
+	def joints_check(kind=kind):
+		"""The check of every joint after a step, as
+		:func:`scenes.Main.step_space` does it.
+		"""
+		space, asteroids = belt(Size(3000, 3000))
+		joints = Joints(space)
+		for joint in join(kind, asteroids, space, 500):
+			joints.add(joint)
+		space.step(1/60)
+		return joints.check
+	benchmark("joints.check."+kind.__name__.lower(), number=100)(joints_check)
+
+	def joints_churn(kind=kind):
+		"""Making joints and snapping them again."""
+		space, asteroids = belt(Size(3000, 3000))
+		joints = Joints(space)
+		def churn():
+			for joint in join(kind, asteroids, space, 100):
+				joints.add(joint)
+			joints.snap(list(joints))
+		return churn
+	benchmark("joints.churn."+kind.__name__.lower())(joints_churn)
+
+def peak_memory(f):
+	"""The most memory allocated at once while calling ``f``, in bytes.
+	Without tracemalloc, this falls back to the growth of the process's
+	maximum resident size, which only catches new peaks.
+	"""
+	if tracemalloc:
+		tracemalloc.start()
+		try:
+			f()
+			return tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+	before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	f()
+	return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-before)*1024
+
+def run(selected, baseline=None, threshold=0.1):
+	"""Run the selected benchmarks, comparing them to the baseline if given.
+
+	:return: The results, as ``{name: {"time": seconds, "memory": bytes}}``,
+	         and the names of any that were more than ``threshold`` slower
+	         than the baseline.
+	"""
+	results = {}
+	regressions = []
+	for name, number, setup in BENCHMARKS:
+		if selected and not any(name.startswith(prefix) for prefix in selected):
+			continue
+		timed = setup()
+		best = min(repeat(timed, number=number, repeat=3))/number
+		memory = peak_memory(timed)
+		results[name] = {"time": best, "memory": memory}
+		line = name.ljust(40)+("%.3f ms" % (best*1000)).rjust(12)+("%.1f KiB" % (memory/1024)).rjust(14)
+		if baseline and name in baseline:
+			change = best/baseline[name]["time"]-1
+			line += ("%+.1f%%" % (change*100)).rjust(10)
+			if change > threshold:
+				regressions.append(name)
+				line += "  REGRESSION"
+		print(line)
+	return results, regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Run the benchmarks.")
+	parser.add_argument("selected", nargs="*",
+		help="Only run benchmarks whose names start with these prefixes.")
+	parser.add_argument("--baseline", default=BASELINE,
+		help="The baseline to compare against, if it exists.")
+	parser.add_argument("--save", action="store_true",
+		help="Save the results as the new baseline (merged into any existing one).")
+	parser.add_argument("--threshold", type=float, default=0.1,
+		help="How much slower than the baseline counts as a regression (0.1 is 10%%).")
+	args = parser.parse_args()
+	baseline = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+	results, regressions = run(args.selected, baseline, args.threshold)
+	if args.save:
+		baseline.update(results)
+		with open(args.baseline, "w") as file:
+			json.dump(baseline, file, indent=1, sort_keys=True)
+	if regressions and not args.save:
+		print(str(len(regressions))+" benchmark(s) regressed: "+", ".join(regressions))
+		sys.exit(1)
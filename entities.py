@@ -25,15 +25,14 @@ In-game stuff.
 from __future__ import division
 
 from random import randint
-from random import uniform
 from itertools import chain
-from itertools import repeat
-from collections import Counter
+from collections import OrderedDict
 import math as maths
 
+import numpy
+
 from pyglet import graphics
 from pyglet import gl
-from pyglet import resource
 from pyglet import sprite
 
 from pymunk import Body
@@ -41,182 +40,511 @@ from pymunk import Circle
 from pymunk import moment_for_circle
 from pymunk import constraint
 
+import generation
 from physics import Vector
-from graphics import centre_image
+from graphics import asset
+from graphics import write_array
+
+def interpolate(body, blend=None):
+	"""Where to draw the body between steps, as ``(x, y, angle)``.
+
+	:param blend: Anything with ``previous``, the ``(x, y, angle)`` of bodies
+	              before the last step keyed by body, and ``alpha``, how far
+	              from there to their current state to draw them - e.g: a
+	              :class:`physics.FixedTimestep`. Without one, or a previous
+	              state for the body, it is drawn where it is.
+	"""
+	x, y = body.position
+	angle = body.angle
+	if blend is None:
+		return x, y, angle
+	previous = blend.previous.get(body)
+	if previous is None:
+		return x, y, angle
+	alpha = blend.alpha
+	px, py, pangle = previous
+	return px+(x-px)*alpha, py+(y-py)*alpha, pangle+(angle-pangle)*alpha
 
 class Stars(object):
-	def __init__(self, size, batch, group):
-		n = size.width*size.height//1000
-		positions = tuple(chain.from_iterable(self.positions(n, size)))
-		batch.add(n, gl.GL_POINTS, group, ('v2i', positions))
+	"""A starfield.
+
+	Star positions are generated in one vectorised pass from a seed, and the
+	most recent few fields are cached by size and seed so later scenes asking
+	for the same field reuse it. Large
+	fields are split into tiles, which are only uploaded while they are near
+	the camera - call :func:`update` each frame for that to happen.
+	"""
+
+	DENSITY = 1/1000
+	TILE = 1024
+	TILED_AREA = 4096*4096
+	CACHE_SIZE = 4
+
+	_cache = OrderedDict()
+
+	def __init__(self, size, batch, group, seed=None):
+		if seed is None:
+			seed = randint(0, 2**31-1)
+		self.size = size
+		self.seed = seed
+		self.batch = batch
+		self.group = group
+		self.positions, self.tile_slices = Stars.field(size, seed)
+		self.tiled = size.width*size.height > Stars.TILED_AREA
+		self.tiles = {}
+		if batch and not self.tiled:
+			self.tiles[None] = self._upload(self.positions)
+
+	@classmethod
+	def field(cls, size, seed):
+		"""The star positions for the given size and seed, sorted by tile,
+		along with the slice of them that falls in each tile.
+		"""
+		key = (size.width, size.height, seed)
+		if key in cls._cache:
+			cls._cache[key] = cls._cache.pop(key)
+		else:
+			n = int(size.width*size.height*Stars.DENSITY)
+			random = numpy.random.RandomState(seed)
+			positions = numpy.column_stack((
+				random.randint(0, size.width+1, n),
+				random.randint(0, size.height+1, n),
+			)).astype(numpy.int32)
+			across = size.width//Stars.TILE+1
+			tile_ids = (positions[:, 1]//Stars.TILE)*across+positions[:, 0]//Stars.TILE
+			order = numpy.argsort(tile_ids, kind="mergesort")
+			positions, tile_ids = positions[order], tile_ids[order]
+			ids = numpy.unique(tile_ids)
+			starts = numpy.searchsorted(tile_ids, ids, side="left")
+			ends = numpy.searchsorted(tile_ids, ids, side="right")
+			slices = {(int(i) % across, int(i)//across): slice(int(start), int(end))
+			          for i, start, end in zip(ids, starts, ends)}
+			cls._cache[key] = positions, slices
+			while len(cls._cache) > Stars.CACHE_SIZE:
+				cls._cache.popitem(last=False)
+		return cls._cache[key]
 
-	def positions(self, n, size):
-		for i in range(n):
-			yield randint(0, size.width), randint(0, size.height)
+	@classmethod
+	def clear_cache(cls):
+		cls._cache.clear()
+
+	def _upload(self, positions):
+		return self.batch.add(len(positions), gl.GL_POINTS, self.group, ('v2i/static', positions.ravel().tolist()))
+
+	def update(self, camera):
+		"""Upload the tiles near the camera, and drop the ones that are not."""
+		if not self.tiled or not self.batch:
+			return
+		left, bottom = int(camera.x//Stars.TILE)-1, int(camera.y//Stars.TILE)-1
+		right = int((camera.x+camera.size.width)//Stars.TILE)+1
+		top = int((camera.y+camera.size.height)//Stars.TILE)+1
+		near = {(x, y) for x in range(left, right+1) for y in range(bottom, top+1) if (x, y) in self.tile_slices}
+		for tile in set(self.tiles)-near:
+			self.tiles.pop(tile).delete()
+		for tile in near-set(self.tiles):
+			self.tiles[tile] = self._upload(self.positions[self.tile_slices[tile]])
+
+class EntityStore(object):
+	"""The hot data for asteroids, packed into arrays with a row per
+	asteroid, so systems can work over the arrays rather than the objects.
+	:class:`Asteroid` objects are views onto their row.
+
+	Rows are handed out in bulk by :func:`allocate`, and those released are
+	reused. ``alive`` says which rows are in use.
+	"""
+
+	CAPACITY = 256
+
+	def __init__(self, capacity=CAPACITY, pool=None):
+		"""
+		:param pool: The :class:`generation.MeshPool` the mesh handles are
+		             into - set by :func:`Asteroid.build` if not given.
+		"""
+		self.pool = pool
+		self.count = 0
+		self.free = []
+		self.ids = numpy.zeros(capacity, dtype=numpy.int64)
+		self.types = numpy.zeros(capacity, dtype=numpy.uint8)
+		self.populated = numpy.zeros(capacity, dtype=bool)
+		self.shown = numpy.zeros(capacity, dtype=bool)
+		self.sizes = numpy.zeros(capacity, dtype=numpy.float64)
+		self.colours = numpy.zeros((capacity, 3), dtype=numpy.uint8)
+		self.meshes = numpy.zeros(capacity, dtype=numpy.int32)
+		self.alive = numpy.zeros(capacity, dtype=bool)
+
+	COLUMNS = ("ids", "types", "populated", "shown", "sizes", "colours", "meshes", "alive")
+
+	def __len__(self):
+		return self.count-len(self.free)
+
+	def _grow(self, capacity):
+		for name in EntityStore.COLUMNS:
+			column = getattr(self, name)
+			grown = numpy.zeros((capacity,)+column.shape[1:], dtype=column.dtype)
+			grown[:len(column)] = column
+			setattr(self, name, grown)
+
+	def allocate(self, ids, types, sizes, colours, meshes):
+		"""Store a batch of asteroids, returning the row of each."""
+		n = len(ids)
+		reused = self.free[-n:] if n else []
+		del self.free[len(self.free)-len(reused):]
+		fresh = n-len(reused)
+		if self.count+fresh > len(self.alive):
+			capacity = len(self.alive)
+			while capacity < self.count+fresh:
+				capacity *= 2
+			self._grow(capacity)
+		rows = numpy.concatenate((numpy.array(reused, dtype=numpy.intp), numpy.arange(self.count, self.count+fresh)))
+		self.count += fresh
+		self.ids[rows] = ids
+		self.types[rows] = types
+		self.sizes[rows] = sizes
+		self.colours[rows] = colours
+		self.meshes[rows] = meshes
+		self.populated[rows] = False
+		self.shown[rows] = False
+		self.alive[rows] = True
+		return rows
+
+	def release(self, row):
+		self.alive[row] = False
+		self.free.append(row)
+
+	def rows(self, asteroids):
+		return numpy.fromiter((asteroid.row for asteroid in asteroids), dtype=numpy.intp, count=len(asteroids))
 
 class Asteroid(object):
+	"""An asteroid - its body and sprite, and a view onto its row of an
+	:class:`EntityStore`.
+	"""
+
+	__slots__ = ("store", "row", "body", "shape", "sprite", "active", "joints", "marker")
 
-	TYPES = {
-		"water": 5,
-		"oil": 3,
-		"uranium": 1,
-		"aluminium": 10,
-		"titanium": 10,
-	}
+	TYPES = generation.TYPES
 
-	def __init__(self, x, y, size, batch, group, space):
+	def __init__(self, store, row, x, y, angle, batch, group, space=None):
+		"""
+		:param store: The :class:`EntityStore` holding the asteroid's size,
+		              type, colour and mesh, in the given row.
+		:param space: The space to add the asteroid to. If None, the caller
+		              is expected to add :attr:`body` and :attr:`shape`.
+		"""
+		self.store = store
+		self.row = row
+		size = self.size
 		x, y = x-size/2, y-size/2
-		points = randint(15, 20)
-		self.batch = batch
 		self.body = Body(size, moment_for_circle(size, 0, size))
 		self.body.position = x, y
 		self.shape = Circle(self.body, 1.1*size)
 		self.shape.elasticity = 0.35
 		self.shape.friction = 0.1
-		self.group = PhysicsBodyGroup(group, self)
-		colour = list(chain.from_iterable(repeat(self.grey(), points)))
-		self.points = list(self.construct_points(points, size))
-		self.vertex_list = batch.add(
-			points, gl.GL_POLYGON, self.group,
-			('v2i', list(chain.from_iterable(self.points))),
-			('c3B', colour)
-		)
-		self.body.angle = randint(0, int(maths.radians(360)/points))
-		self.type = self._weighted_random_choice(Asteroid.TYPES)
-		self.sprite = sprite.Sprite(centre_image(resource.image("raw_"+self.type+".png")), 0, 0, batch=batch, group=self.group)
-		self.sprite.visible = False
-		self._populated = False
-		space.add(self.body, self.shape)
+		self.body.angle = angle
+		self.sprite = None
+		if batch:
+			self.sprite = sprite.Sprite(asset("raw_"+self.type+".png"), x, y, batch=batch, group=group)
+			self.sprite.visible = False
+		self.active = True
+		# Most asteroids are never joined, so they share an empty tuple until
+		# they are - see Joint.
+		self.joints = ()
+		if space:
+			space.add(self.body, self.shape)
 
-	def grey(self):
-		grey = randint(75, 190)
-		return grey, grey, grey
+	@property
+	def id(self):
+		return int(self.store.ids[self.row])
 
-	def construct_points(self, n, size):
-		angle = maths.radians(360)/n
-		for a in (angle*i for i in range(n)):
-			random_size = uniform(1, 1.3)*size
-			yield int(random_size*maths.cos(a)), int(random_size*maths.sin(a))
+	@property
+	def size(self):
+		return float(self.store.sizes[self.row])
+
+	@property
+	def mesh(self):
+		return int(self.store.meshes[self.row])
+
+	@property
+	def outline(self):
+		"""The unit outline, at evenly spaced angles, shared with other
+		asteroids and scaled by the size.
+		"""
+		return self.store.pool.outlines[self.mesh]
+
+	@property
+	def step(self):
+		"""The angle between points of the outline."""
+		return maths.radians(360)/self.store.pool.counts[self.mesh]
+
+	@property
+	def colour(self):
+		return tuple(self.store.colours[self.row].tolist())
+
+	@property
+	def type(self):
+		return generation.TYPE_NAMES[self.store.types[self.row]]
+
+	@property
+	def shown(self):
+		return bool(self.store.shown[self.row])
 
 	@property
 	def position(self):
 		return Vector(*self.body.position)
 
+	@property
+	def points(self):
+		"""The outline, in local coordinates."""
+		size = self.size
+		return [(x*size, y*size) for x, y in self.outline]
+
 	@classmethod
-	def populate(cls, min, max, world_size, batch, group, space):
-		main = Segment(size=world_size)
-		#return cls.verify(
-		return [Asteroid(segment.centre.x, segment.centre.y, randint(min, max), batch, group, space) for segment in main.recursive_split(max*1.75)]#)
+	def populate(cls, min, max, world_size, batch, group, space, seed=None):
+		if seed is None:
+			seed = randint(0, 2**31-1)
+		return cls.build(generation.layout(world_size, min, max, seed), batch, group, space)
 
 	@classmethod
-	def verify(cls, asteroids):
-		""" Ensure we have at least 1 of each asteroid. Don't want to screw
-		people over.
+	def build(cls, layout, batch, group, space, indices=None, store=None):
+		"""Create the asteroids for a :class:`generation.Layout`, adding them
+		to the space all at once.
+
+		:param indices: If given, only the asteroids at these indices in the
+		                layout are created.
+		:param store: The :class:`EntityStore` to keep them in - a new one if
+		              not given.
 		"""
-		count = Counter(asteroid.type for asteroid in asteroids)
-		for type in Asteroid.TYPES:
-			if count[type] < 1:
-				return False
+		if indices is None:
+			indices = numpy.arange(len(layout))
+		if store is None:
+			store = EntityStore()
+		if store.pool is None:
+			store.pool = layout.pool
+		rows = store.allocate(indices, layout.types[indices], layout.sizes[indices],
+			layout.colours[indices], layout.meshes[indices])
+		asteroids = []
+		for row, x, y, vx, vy, angle in zip(rows.tolist(),
+				layout.x[indices].tolist(), layout.y[indices].tolist(),
+				layout.vx[indices].tolist(), layout.vy[indices].tolist(),
+				layout.angles[indices].tolist()):
+			asteroid = cls(store, row, x, y, angle, batch, group)
+			asteroid.body.velocity = vx, vy
+			asteroids.append(asteroid)
+		if asteroids:
+			space.add(*chain.from_iterable((asteroid.body, asteroid.shape) for asteroid in asteroids))
 		return asteroids
 
-	def _weighted_random_choice(self, choices):
-		max = sum(choices.values())
-		pick = uniform(0, max)
-		current = 0
-		for key, value in choices.items():
-			current += value
-			if current > pick:
-				return key
-
 	@property
 	def populated(self):
-		return self._populated
+		return bool(self.store.populated[self.row])
 
 	@populated.setter
 	def populated(self, populated):
-		if not populated == self._populated:
-			self._populated = populated
+		if not populated == self.populated:
+			self.store.populated[self.row] = populated
+			if self.type == "home": #HACK
+				self.store.shown[self.row] = True
+			if not self.sprite:
+				return
 			if populated:
 				name = self.type
 			else:
 				name = "raw_"+self.type
-			self.sprite.image = centre_image(resource.image(name+".png"))
-			if self.type == "home": #HACK
-				self.sprite.visible = True
+			self.sprite.image = asset(name+".png")
 
 	def point_over(self, x, y):
 		sx, sy = self.position
 		return (x-sx)**2+(y-sy)**2 < self.shape.radius**2
 
-	def destroy(self):
-		self.vertex_list.delete()
-		del self
+	def destroy(self, renderer):
+		if renderer:
+			renderer.remove([self])
+		if self.sprite:
+			self.sprite.delete()
+		self.store.release(self.row)
+
+	def nearest_point(self, x, y):
+		"""The outline point nearest to the given world point, in the
+		asteroid's local coordinates.
+
+		The outline is generated at evenly spaced angles, so the mesh is
+		already a table sorted by angle - we only need to compare the two
+		points either side of the given point's angle.
+		"""
+		bx, by = self.body.position
+		angle = self.body.angle
+		cos, sin = maths.cos(angle), maths.sin(angle)
+		dx, dy = x-bx, y-by
+		lx, ly = dx*cos+dy*sin, dy*cos-dx*sin
+		size = self.size
+		outline = self.outline
+		n = len(outline)
+		i = int(maths.atan2(ly, lx)//self.step) % n
+		ax, ay = outline[i]
+		bx, by = outline[(i+1) % n]
+		ax, ay, bx, by = ax*size, ay*size, bx*size, by*size
+		if (lx-ax)**2+(ly-ay)**2 <= (lx-bx)**2+(ly-by)**2:
+			return ax, ay
+		return bx, by
 
 	def hovered(self, x, y):
-		sx, sy = self.position
-		x, y = (Vector(x-sx, y-sy)).closest(Vector(*point) for point in self.points)
+		x, y = self.nearest_point(x, y)
 		self.marker.x = x
 		self.marker.y = y
 
-class Segment(object):
-
-	RAGGEDNESS = 0.5
-
-	def __init__(self, width=None, height=None, x=0, y=0, size=None):
-		if size:
-			self.width = size.width
-			self.height = size.height
-		else:
-			self.width = width
-			self.height = height
-		self.x = x
-		self.y = y
-
-	def split(self, minimum):
-		ragged_factor = uniform(0, Segment.RAGGEDNESS)
-		if self.width > self.height:
-			width = self.width/2
-			ragged_factor *= width
-			if width-ragged_factor < minimum:
-				return self
-			return Segment(width+ragged_factor, self.height, self.x, self.y), Segment(width-ragged_factor, self.height, self.x+width+ragged_factor, self.y)
+class AsteroidRenderer(object):
+	"""Draws every visible asteroid outline in a single call from one indexed
+	GL_TRIANGLES vertex list.
+
+	Rather than each asteroid pushing its own matrix, outlines are transformed
+	into world space on the CPU in one vectorised pass each frame. Each
+	outline is fanned from its first point, just as GL_POLYGON is drawn. Only
+	the visible outlines are kept packed at the start of a growable vertex
+	list, whose indices and colours are rewritten in place when which
+	asteroids are visible changes - the rest of the indices are left as
+	degenerate triangles. Resource sprites of asteroids that are ``shown``
+	follow their asteroids, and are hidden while their asteroid is out of
+	view.
+	"""
+
+	def __init__(self, batch, group, meshes, store, capacity=1024):
+		"""
+		:param meshes: The :class:`generation.MeshPool` the asteroids' outlines
+		               are from.
+		:param store: The :class:`EntityStore` the asteroids are kept in.
+		:param capacity: How many vertices to make room for up front. The list
+		                 doubles whenever more are visible at once.
+		"""
+		self.batch = batch
+		self.group = group
+		self.meshes = meshes
+		self.store = store
+		self.asteroids = []
+		self.showing = set()
+		self.capacity = capacity
+		# A fan has two fewer triangles than points, so three indices a vertex
+		# is always enough.
+		self.vertex_list = batch.add_indexed(capacity, gl.GL_TRIANGLES, group, [0]*(capacity*3),
+			('v2f/stream', [0]*(capacity*2)),
+			('c3B/dynamic', [0]*(capacity*3))
+		)
+		self.drawn = None
+		self._build()
+
+	def add(self, asteroids):
+		self.asteroids.extend(asteroids)
+		self._build()
+
+	def remove(self, asteroids):
+		removed = set(asteroids)
+		self.asteroids = [asteroid for asteroid in self.asteroids if asteroid not in removed]
+		for asteroid in self.showing & removed:
+			asteroid.sprite.visible = False
+		self.showing -= removed
+		self._build()
+
+	def _build(self):
+		"""Work out the outlines and colours of the current asteroids. This only
+		happens when asteroids are added or removed.
+		"""
+		self.slots = {asteroid: slot for slot, asteroid in enumerate(self.asteroids)}
+		self._draw(numpy.zeros(0, dtype=numpy.intp))
+		self.drawn = None
+		if not self.asteroids:
+			return
+		self.rows = rows = self.store.rows(self.asteroids)
+		meshes = self.store.meshes[rows]
+		sizes = self.store.sizes[rows].astype(numpy.float32)
+		self.counts = counts = self.meshes.counts[meshes]
+		self.starts = numpy.cumsum(counts)-counts
+		owner = numpy.repeat(numpy.arange(len(self.asteroids)), counts)
+		self.local = self.meshes.points[self.meshes.vertices(meshes)].astype(numpy.float32)*sizes[owner, None]
+		self.colours = numpy.repeat(self.store.colours[rows], counts, axis=0)
+
+	def _grow(self, needed):
+		while self.capacity < needed:
+			self.capacity *= 2
+		self.vertex_list.resize(self.capacity, self.capacity*3)
+
+	def _draw(self, slots):
+		"""Pack the outlines of the asteroids in the given (sorted) slots at
+		the start of the vertex list, and index just those.
+		"""
+		self.drawn = slots
+		if not len(slots):
+			self.vertices = numpy.zeros(0, dtype=numpy.intp)
+			indices = numpy.zeros(0, dtype=numpy.uint32)
 		else:
-			height = self.height/2
-			ragged_factor *= height
-			if height-ragged_factor < minimum:
-				return self
-			return Segment(self.width, height+ragged_factor, self.x, self.y), Segment(self.width, height-ragged_factor, self.x, self.y+height+ragged_factor)
-
-	def recursive_split(self, minimum):
-		parts = self.split(minimum)
-		try:
-			first, second = parts
-			for segment in first.recursive_split(minimum):
-				yield segment
-			for segment in second.recursive_split(minimum):
-				yield segment
-		except TypeError:
-			yield parts
-
-	@property
-	def centre(self):
-		return Vector(self.x+self.width/2, self.y+self.width/2)
+			counts = self.counts[slots]
+			starts = numpy.cumsum(counts)-counts
+			self.owner = numpy.repeat(numpy.arange(len(slots)), counts)
+			self.vertices = numpy.repeat(self.starts[slots]-starts, counts)+numpy.arange(counts.sum())
+			fans = counts-2
+			first = numpy.repeat(starts, fans)
+			offset = numpy.arange(fans.sum())-numpy.repeat(numpy.cumsum(fans)-fans, fans)+1
+			indices = numpy.column_stack((first, first+offset, first+offset+1)).ravel()
+		if len(self.vertices) > self.capacity:
+			self._grow(len(self.vertices))
+		self.world = numpy.empty((len(self.vertices), 2), dtype=numpy.float32)
+		# Indices are into the whole domain, so are offset by where the list
+		# starts. Every index past the used ones points at the first vertex.
+		start = self.vertex_list.start
+		packed = numpy.full(self.capacity*3, start, dtype=numpy.uint32)
+		packed[:len(indices)] += indices.astype(numpy.uint32)
+		write_array(self.vertex_list.indices, packed)
+		if len(self.vertices):
+			write_array(self.vertex_list.colors, self.colours[self.vertices])
+
+	def update(self, visible=None, blend=None):
+		"""Move outlines to their bodies' current positions and angles.
+
+		:param visible: If given, only these asteroids are drawn.
+		:param blend: Where between steps to draw the bodies, as for
+		              :func:`interpolate`.
+		"""
+		if not self.asteroids:
+			return
+		if visible is None:
+			visible = self.asteroids
+		slots = numpy.fromiter((self.slots[asteroid] for asteroid in visible), dtype=numpy.intp, count=len(visible))
+		order = numpy.argsort(slots)
+		slots = slots[order]
+		visible = [visible[i] for i in order.tolist()]
+		if self.drawn is None or not numpy.array_equal(slots, self.drawn):
+			self._draw(slots)
+		showing = set()
+		if visible:
+			state = numpy.array([interpolate(asteroid.body, blend) for asteroid in visible])
+			x, y, angle = state[:, 0], state[:, 1], state[:, 2]
+			owner = self.owner
+			cos, sin = numpy.cos(angle)[owner], numpy.sin(angle)[owner]
+			lx, ly = self.local[self.vertices, 0], self.local[self.vertices, 1]
+			self.world[:, 0] = lx*cos-ly*sin+x[owner]
+			self.world[:, 1] = lx*sin+ly*cos+y[owner]
+			write_array(self.vertex_list.vertices, self.world)
+			shown = numpy.flatnonzero(self.store.shown[self.rows[slots]])
+			for i, ax, ay, a in zip(shown.tolist(), x[shown].tolist(), y[shown].tolist(), angle[shown].tolist()):
+				asteroid = visible[i]
+				asteroid.sprite.set_position(ax, ay)
+				asteroid.sprite.rotation = -maths.degrees(a)
+				asteroid.sprite.visible = True
+				showing.add(asteroid)
+		for asteroid in self.showing-showing:
+			asteroid.sprite.visible = False
+		self.showing = showing
 
 class PhysicsBodyGroup(graphics.Group):
 	def __init__(self, parent, body):
 		super(PhysicsBodyGroup, self).__init__(parent=parent)
 		self.body = body
+		self.blend = None
 
 	def set_state(self):
 		gl.glPushMatrix()
-		x, y = self.body.body.position
+		x, y, angle = interpolate(self.body.body, self.blend)
 		gl.glTranslatef(x, y, 0)
-		gl.glRotatef(maths.degrees(self.body.body.angle), 0, 0, 1)
+		gl.glRotatef(maths.degrees(angle), 0, 0, 1)
 
 	def unset_state(self):
-		x, y = self.body.body.position
-		gl.glTranslatef(-x, -y, 0)
-		gl.glRotatef(-maths.degrees(self.body.body.angle), 0, 0, 1)
 		gl.glPopMatrix()
 
 	def __eq__(self, other):
@@ -224,10 +552,17 @@ class PhysicsBodyGroup(graphics.Group):
 		        self.texture == other.__class__)
 
 class Person(object):
+
+	__slots__ = ("speed", "group", "sprite", "body", "shape", "old", "target")
+
+	IMPULSE = 20
+
 	def __init__(self, x, y, batch, group, space):
 		self.speed = 10
 		self.group = PhysicsBodyGroup(group, self)
-		self.sprite = sprite.Sprite(centre_image(resource.image("pushing.png")), 0, 0, batch=batch, group=self.group)
+		self.sprite = None
+		if batch:
+			self.sprite = sprite.Sprite(asset("pushing.png"), 0, 0, batch=batch, group=self.group)
 		self.body = Body(2, moment_for_circle(2, 5, 14))
 		self.body.position = x, y
 		self.shape = Circle(self.body, 15)
@@ -239,63 +574,229 @@ class Person(object):
 
 	@classmethod
 	def populate(cls, world_size, batch, group, space):
-		return[Person(0, 0, batch, group, space) for _ in range(20)]
+		return Crowd(Person(0, 0, batch, group, space) for _ in range(20))
 
 	def update(self):
 		angle = -maths.atan2(*Vector(*self.target)-Vector(*self.body.position))
 		self.body.angle = angle
 		x, y = self.body.position
-		self.body.apply_impulse((20*maths.sin(angle), -20*maths.cos(angle)))
+		self.body.apply_impulse((Person.IMPULSE*maths.sin(angle), -Person.IMPULSE*maths.cos(angle)))
+
+class Crowd(object):
+	"""Steers many people at once, working out every heading and impulse in
+	a single vectorised pass. Each person is steered exactly as
+	:func:`Person.update` would, towards its ``target`` at the time.
+	"""
+
+	def __init__(self, people=()):
+		self.people = []
+		self.targets = numpy.zeros((0, 2))
+		self.positions = numpy.zeros((0, 2))
+		self.headings = numpy.zeros(0)
+		self.add(people)
+
+	def __len__(self):
+		return len(self.people)
+
+	def __iter__(self):
+		return iter(self.people)
+
+	def add(self, people):
+		people = list(people)
+		if not people:
+			return
+		self.people.extend(people)
+		self.targets = numpy.zeros((len(self.people), 2))
+		self.positions = numpy.zeros((len(self.people), 2))
+		self.headings = numpy.zeros(len(self.people))
+
+	def remove(self, people):
+		people = set(people)
+		keep = [i for i, person in enumerate(self.people) if person not in people]
+		self.people = [self.people[i] for i in keep]
+		self.targets = self.targets[keep]
+		self.positions = self.positions[keep]
+		self.headings = self.headings[keep]
+
+	def target(self, x, y):
+		"""Send everyone towards the same point."""
+		for person in self.people:
+			person.target = x, y
 
-class Strut(object):
-	def __init__(self, asteroid_1, asteroid_2, pos_1, pos_2, space):
-		self.constraint = constraint.PinJoint(asteroid_1.body, asteroid_2.body, pos_1, pos_2)
+	def update(self):
+		bodies = [person.body for person in self.people]
+		if not bodies:
+			return
+		self.positions[:] = [tuple(body.position) for body in bodies]
+		self.targets[:] = [tuple(person.target) for person in self.people]
+		offsets = self.targets-self.positions
+		self.headings = -numpy.arctan2(offsets[:, 0], offsets[:, 1])
+		impulses = Person.IMPULSE*numpy.column_stack((numpy.sin(self.headings), -numpy.cos(self.headings)))
+		for body, angle, impulse in zip(bodies, self.headings.tolist(), impulses.tolist()):
+			body.angle = angle
+			body.apply_impulse(tuple(impulse))
+
+class ConstraintRenderer(object):
+	"""Draws the lines for every constraint from a single growable GL_LINES
+	vertex list, updating endpoints in place rather than reallocating. Unused
+	slots are left as zero-length lines.
+	"""
+
+	def __init__(self, batch, group, capacity=32):
+		self.capacity = capacity
+		self.vertex_list = batch.add(capacity*2, gl.GL_LINES, group, ('v2f/stream', [0]*(capacity*4)))
+		self.owners = []
+		self.slots = {}
+
+	def __len__(self):
+		return len(self.owners)
+
+	def __contains__(self, owner):
+		return owner in self.slots
+
+	def add(self, owner):
+		if len(self.owners) == self.capacity:
+			self._grow()
+		self.slots[owner] = len(self.owners)
+		self.owners.append(owner)
+
+	def remove(self, owner):
+		"""Remove the owner's line, moving the last line into its slot so the
+		used part of the list stays packed.
+		"""
+		slot = self.slots.pop(owner)
+		last = self.owners.pop()
+		vertices = self.vertex_list.vertices
+		if last is not owner:
+			self.owners[slot] = last
+			self.slots[last] = slot
+			vertices[slot*4:slot*4+4] = vertices[len(self.owners)*4:len(self.owners)*4+4]
+		vertices[len(self.owners)*4:len(self.owners)*4+4] = [0, 0, 0, 0]
+
+	def _grow(self):
+		old = self.capacity
+		self.capacity *= 2
+		self.vertex_list.resize(self.capacity*2)
+		self.vertex_list.vertices[old*4:] = [0]*((self.capacity-old)*4)
+
+	def update(self, bounds=None, blend=None):
+		"""Write the current endpoints of every owner into the vertex list.
+
+		:param bounds: If given, as ``(left, bottom, right, top)``, lines that
+		               are entirely outside it are collapsed to nothing.
+		:param blend: Where between steps to draw, as for
+		              :func:`interpolate`.
+		"""
+		vertices = self.vertex_list.vertices
+		for slot, owner in enumerate(self.owners):
+			ax, ay, bx, by = endpoints = owner.endpoints(blend)
+			if bounds:
+				left, bottom, right, top = bounds
+				if (max(ax, bx) < left or min(ax, bx) > right or
+				    max(ay, by) < bottom or min(ay, by) > top):
+					endpoints = (0, 0, 0, 0)
+			vertices[slot*4:slot*4+4] = endpoints
+
+class Joint(object):
+	"""A constraint between two asteroids, drawn as a line, that snaps under
+	too much strain - see :class:`Joints`.
+	"""
+
+	__slots__ = ("asteroids", "constraint", "space", "active")
+
+	BREAKING_IMPULSE = 1000
+
+	def __init__(self, asteroid_1, asteroid_2, constraint, space):
+		self.asteroids = asteroid_1, asteroid_2
+		self.constraint = constraint
 		self.space = space
+		self.active = True
+		for asteroid in self.asteroids:
+			if not asteroid.joints:
+				asteroid.joints = set()
+			asteroid.joints.add(self)
+			asteroid.body.activate()
 		space.add(self.constraint)
-		self.vertex_list = None
-
-	def update(self, batch, group):
-		if self.constraint.impulse > 1000:
-			self.snap()
-			return True
-		if self.vertex_list:
-			self.vertex_list.delete()
-		ax, ay = self.constraint.a.position+Vector(*self.constraint.anchr1)
-		bx, by = self.constraint.b.position+Vector(*self.constraint.anchr2)
-		points = [int(x) for x in [ax, ay, bx, by]]
-		self.vertex_list = batch.add(
-			2, gl.GL_LINES, group,
-			('v2i', tuple(points))
-		)
 
-
-	def snap(self):
-		if self.vertex_list:
-			self.vertex_list.delete()
-		self.space.remove(self.constraint)
-
-class Umbilical(object):
-		def __init__(self, asteroid_1, asteroid_2, pos_1, pos_2, space):
-			self.constraint = constraint.DampedSpring(asteroid_1.body, asteroid_2.body, pos_1, pos_2)
-			self.space = space
-			space.add(self.constraint)
-			self.vertex_list = None
-
-		def update(self, batch, group):
-			if self.constraint.impulse > 1000:
-				self.snap()
-				return True
-			if self.vertex_list:
-				self.vertex_list.delete()
-			ax, ay = self.constraint.a.position+Vector(*self.constraint.anchr1)
-			bx, by = self.constraint.b.position+Vector(*self.constraint.anchr2)
-			points = [int(x) for x in [ax, ay, bx, by]]
-			self.vertex_list = batch.add(
-				2, gl.GL_LINES, group,
-				('v2i', tuple(points))
-			)
-
-		def snap(self):
-			if self.vertex_list:
-				self.vertex_list.delete()
+	def freeze(self):
+		"""Take the joint out of the space, while one of its asteroids is."""
+		if self.active:
+			self.active = False
 			self.space.remove(self.constraint)
+
+	def thaw(self):
+		"""Put the joint back in the space, if both its asteroids are."""
+		if not self.active and all(asteroid.active for asteroid in self.asteroids):
+			self.active = True
+			self.space.add(self.constraint)
+
+	def endpoints(self, blend=None):
+		ax, ay, _ = interpolate(self.constraint.a, blend)
+		bx, by, _ = interpolate(self.constraint.b, blend)
+		(a1x, a1y), (a2x, a2y) = self.constraint.anchr1, self.constraint.anchr2
+		return ax+a1x, ay+a1y, bx+a2x, by+a2y
+
+class Joints(object):
+	"""Every joint in the belt. After each physics step, :func:`check` reads
+	the strain on all the joints in the space in one pass and snaps the broken
+	ones together, leaving the rest untouched.
+
+	pymunk has no callbacks for constraints, so the impulses still have to be
+	read, but nothing else is done for joints that hold.
+	"""
+
+	def __init__(self, space, renderer=None):
+		self.space = space
+		self.renderer = renderer
+		self.joints = set()
+		self.remote = None
+
+	def __len__(self):
+		return len(self.joints)
+
+	def __iter__(self):
+		return iter(self.joints)
+
+	def __contains__(self, joint):
+		return joint in self.joints
+
+	def add(self, joint):
+		self.joints.add(joint)
+		if self.renderer:
+			self.renderer.add(joint)
+		if self.remote:
+			self.remote.join(joint)
+
+	def check(self):
+		"""Snap every joint under too much strain, returning them."""
+		broken = [joint for joint in self.joints if joint.active and joint.constraint.impulse > joint.BREAKING_IMPULSE]
+		if broken:
+			self.snap(broken)
+		return broken
+
+	def snap(self, joints):
+		for joint in joints:
+			for asteroid in joint.asteroids:
+				asteroid.joints.discard(joint)
+				if not asteroid.joints:
+					asteroid.joints = ()
+			if self.renderer and joint in self.renderer:
+				self.renderer.remove(joint)
+		constraints = [joint.constraint for joint in joints if joint.active]
+		if constraints:
+			self.space.remove(*constraints)
+		self.joints.difference_update(joints)
+
+class Strut(Joint):
+
+	__slots__ = ()
+
+	def __init__(self, asteroid_1, asteroid_2, pos_1, pos_2, space):
+		super(Strut, self).__init__(asteroid_1, asteroid_2, constraint.PinJoint(asteroid_1.body, asteroid_2.body, pos_1, pos_2), space)
+
+class Umbilical(Joint):
+
+	__slots__ = ()
+
+	def __init__(self, asteroid_1, asteroid_2, pos_1, pos_2, space):
+		super(Umbilical, self).__init__(asteroid_1, asteroid_2, constraint.DampedSpring(asteroid_1.body, asteroid_2.body, pos_1, pos_2), space)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+World generation.
+
+Generating a belt happens in two phases. :func:`layout` is pure and seedable -
+it decides where every asteroid goes and what it looks like, producing a
+:class:`Layout` of arrays, and can spread the work across processes for huge
+worlds. The entities are then built from that layout in bulk.
+"""
+
+from __future__ import division
+
+import math as maths
+from random import Random
+from multiprocessing import Pool
+
+import numpy
+
+from physics import Vector
+
+TYPES = {
+	"water": 5,
+	"oil": 3,
+	"uranium": 1,
+	"aluminium": 10,
+	"titanium": 10,
+}
+
+# Type ids, as stored in a layout. Sorted so ids don't depend on dict order.
+TYPE_NAMES = sorted(TYPES)+["home"]
+
+MIN_POINTS = 15
+MAX_POINTS = 20
+MIN_GREY = 75
+MAX_GREY = 190
+ROUGHNESS = 1.3
+
+# The largest impulse asteroids start with, to make stuff a bit more
+# interesting.
+DRIFT = 20000
+
+# Every belt has at least this many asteroids of each type, if it is big
+# enough.
+MINIMUM_OF_EACH = 1
+
+# Worlds are laid out in independent regions of this size, each with its own
+# seed, so the result is the same however many processes are used.
+REGION = 4096
+
+# How many segments are laid out between progress reports.
+PROGRESS_BATCH = 64
+
+_random = Random()
+
+class Segment(object):
+
+	RAGGEDNESS = 0.5
+
+	def __init__(self, width=None, height=None, x=0, y=0, size=None):
+		if size:
+			self.width = size.width
+			self.height = size.height
+		else:
+			self.width = width
+			self.height = height
+		self.x = x
+		self.y = y
+
+	def split(self, minimum, random=None):
+		ragged_factor = (random or _random).uniform(0, Segment.RAGGEDNESS)
+		if self.width > self.height:
+			width = self.width/2
+			ragged_factor *= width
+			if width-ragged_factor < minimum:
+				return self
+			return Segment(width+ragged_factor, self.height, self.x, self.y), Segment(width-ragged_factor, self.height, self.x+width+ragged_factor, self.y)
+		else:
+			height = self.height/2
+			ragged_factor *= height
+			if height-ragged_factor < minimum:
+				return self
+			return Segment(self.width, height+ragged_factor, self.x, self.y), Segment(self.width, height-ragged_factor, self.x, self.y+height+ragged_factor)
+
+	def recursive_split(self, minimum, random=None):
+		"""Split until the segments can't be split any further, yielding them
+		in depth-first order. This uses an explicit stack rather than actually
+		recursing, so small minimums on large worlds don't run deep.
+		"""
+		stack = [self]
+		while stack:
+			parts = stack.pop().split(minimum, random)
+			if isinstance(parts, Segment):
+				yield parts
+			else:
+				first, second = parts
+				stack.append(second)
+				stack.append(first)
+
+	@property
+	def centre(self):
+		return Vector(self.x+self.width/2, self.y+self.width/2)
+
+class MeshPool(object):
+	"""Unit outlines for asteroids, a number of random variants for each point
+	count, which asteroids share and scale by their size.
+
+	All the outlines are stored end to end in ``points``, with ``counts`` and
+	``offsets`` saying where each mesh's points are. ``outlines`` holds the same
+	points as a list of ``(x, y)`` tuples for each mesh, for per-point lookups.
+	"""
+
+	VARIANTS = 8
+
+	def __init__(self, counts, points):
+		self.counts = counts
+		self.offsets = numpy.cumsum(counts)-counts
+		self.points = points
+		self.outlines = [[tuple(point) for point in points[offset:offset+count].tolist()]
+		                 for offset, count in zip(self.offsets.tolist(), counts.tolist())]
+
+	@classmethod
+	def generate(cls, seed, variants=VARIANTS):
+		"""A pool of random meshes - the same seed always gives the same pool."""
+		random = numpy.random.RandomState(seed)
+		counts = numpy.repeat(numpy.arange(MIN_POINTS, MAX_POINTS+1), variants)
+		owner = numpy.repeat(numpy.arange(len(counts)), counts)
+		index = numpy.arange(counts.sum())-(numpy.cumsum(counts)-counts)[owner]
+		angles = 2*maths.pi*index/counts[owner]
+		radii = random.uniform(1, ROUGHNESS, len(owner))
+		return cls(counts, numpy.column_stack((radii*numpy.cos(angles), radii*numpy.sin(angles))))
+
+	def __len__(self):
+		return len(self.counts)
+
+	def vertices(self, meshes):
+		"""The indices into ``points`` of every point of the given meshes, one
+		mesh after another.
+		"""
+		counts = self.counts[meshes]
+		return numpy.repeat(self.offsets[meshes]-(numpy.cumsum(counts)-counts), counts)+numpy.arange(counts.sum())
+
+class Layout(object):
+	"""Where every asteroid in a belt goes and what it looks like, as arrays.
+
+	Each asteroid's outline is one of the pool's meshes, given by ``meshes``,
+	scaled by its size. ``vx`` and ``vy`` are the velocities the asteroids
+	start with. ``home`` is the index of the home asteroid, once types have
+	been assigned.
+	"""
+
+	FIELDS = ("x", "y", "vx", "vy", "sizes", "meshes", "colours", "angles", "types")
+
+	def __init__(self, pool, x, y, vx, vy, sizes, meshes, colours, angles, types, home=None):
+		self.pool = pool
+		self.x = x
+		self.y = y
+		self.vx = vx
+		self.vy = vy
+		self.sizes = sizes
+		self.meshes = meshes
+		self.colours = colours
+		self.angles = angles
+		self.types = types
+		self.home = home
+
+	def __len__(self):
+		return len(self.sizes)
+
+	@property
+	def counts(self):
+		return self.pool.counts[self.meshes]
+
+	def type(self, i):
+		return TYPE_NAMES[self.types[i]]
+
+	@classmethod
+	def concatenate(cls, pool, layouts):
+		layouts = list(layouts)
+		return cls(pool, *(numpy.concatenate([getattr(layout, field) for layout in layouts]) for field in cls.FIELDS))
+
+def layout(world_size, minimum, maximum, seed, processes=None, progress=None):
+	"""Lay out a belt filling the world.
+
+	:param minimum: The smallest asteroid size.
+	:param maximum: The largest asteroid size.
+	:param seed: The same seed always gives the same layout. Types are
+	             assigned by :func:`assign_types`, so every belt is fair.
+	:param processes: How many processes to spread the work over, for worlds
+	                  bigger than a single region. None uses one per core, 1
+	                  does it all in this process.
+	:param progress: If given, called with the fraction of the world laid out
+	                 so far - after each region when using processes, or
+	                 every :data:`PROGRESS_BATCH` segments otherwise.
+	"""
+	meshes = MeshPool.generate(seed)
+	regions = [(meshes, x, y, min(REGION, world_size.width-x), min(REGION, world_size.height-y), minimum, maximum, _region_seed(seed, i))
+	           for i, (x, y) in enumerate((x, y) for y in range(0, world_size.height, REGION)
+	                                             for x in range(0, world_size.width, REGION))]
+	area = world_size.width*world_size.height
+	layouts = []
+	done = 0
+	if len(regions) > 1 and processes != 1:
+		pool = Pool(processes)
+		try:
+			for i, region_layout in enumerate(pool.imap(_layout_region, regions)):
+				layouts.append(region_layout)
+				done += regions[i][3]*regions[i][4]
+				if progress:
+					progress(done/area)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		for region in regions:
+			region_progress = None
+			if progress:
+				region_progress = lambda covered, done=done: progress((done+covered)/area)
+			layouts.append(_layout_region(region, region_progress))
+			done += region[3]*region[4]
+	belt = Layout.concatenate(meshes, layouts)
+	assign_types(belt, world_size, seed)
+	return belt
+
+def assign_types(layout, world_size, seed, minimum=MINIMUM_OF_EACH):
+	"""Pick the home asteroid and the type of every other asteroid, in a
+	single pass, guaranteeing a fair belt.
+
+	The home is picked from the asteroids in the top quarter of the world (or
+	is the highest asteroid, if there are none), and doesn't drift. Every type
+	then gets a quota of at least ``minimum`` asteroids, and otherwise in
+	proportion to its weight, with any left over picked at random by weight.
+	The types are then shuffled across the asteroids.
+	"""
+	n = len(layout)
+	if not n:
+		return
+	random = numpy.random.RandomState(seed)
+	heights = layout.y-layout.sizes/2
+	candidates = numpy.flatnonzero(heights > world_size.height/4*3)
+	if len(candidates):
+		home = int(random.choice(candidates))
+	else:
+		home = int(numpy.argmax(heights))
+	weights = numpy.array([TYPES[name] for name in TYPE_NAMES[:-1]], dtype=numpy.float64)
+	weights /= weights.sum()
+	remaining = n-1
+	quotas = numpy.maximum(minimum, numpy.floor(remaining*weights)).astype(int)
+	while quotas.sum() > remaining:
+		quotas[numpy.argmax(quotas)] -= 1
+	extra = random.choice(len(weights), remaining-quotas.sum(), p=weights)
+	types = numpy.concatenate((numpy.repeat(numpy.arange(len(weights)), quotas), extra)).astype(numpy.uint8)
+	random.shuffle(types)
+	layout.types = numpy.insert(types, home, TYPE_NAMES.index("home"))
+	layout.vx[home] = layout.vy[home] = 0
+	layout.home = home
+
+def _region_seed(seed, i):
+	return (seed*1000003+i) % 2**32
+
+def _layout_region(region, progress=None):
+	"""Lay out a single region, calling ``progress`` with the area covered so
+	far every :data:`PROGRESS_BATCH` segments.
+	"""
+	pool, x, y, width, height, minimum, maximum, seed = region
+	segments = []
+	covered = 0
+	for segment in Segment(width, height, x, y).recursive_split(maximum*1.75, Random(seed)):
+		segments.append(segment)
+		covered += segment.width*segment.height
+		if progress and not len(segments) % PROGRESS_BATCH:
+			progress(covered)
+	if progress:
+		progress(covered)
+	centres = numpy.array([(segment.centre.x, segment.centre.y) for segment in segments], dtype=numpy.float64).reshape(-1, 2)
+	n = len(centres)
+	random = numpy.random.RandomState(seed)
+	sizes = random.randint(minimum, maximum+1, n)
+	meshes = random.randint(0, len(pool), n)
+	greys = random.randint(MIN_GREY, MAX_GREY+1, n).astype(numpy.uint8)
+	colours = numpy.column_stack((greys, greys, greys))
+	angles = random.uniform(0, 1, n)*2*maths.pi/pool.counts[meshes]
+	types = numpy.zeros(n, dtype=numpy.uint8)
+	vx = random.triangular(-DRIFT, 0, DRIFT, n)/sizes
+	vy = random.triangular(-DRIFT, 0, DRIFT, n)/sizes
+	return Layout(pool, centres[:, 0], centres[:, 1], vx, vy, sizes, meshes, colours, angles, types)
@@ -24,9 +24,16 @@ Graphics related stuff.
 
 from __future__ import division
 
+import os
+import ctypes
+
+import numpy
 from pyglet.window import key
 from pyglet import gl
 from pyglet import graphics
+from pyglet import resource
+from pyglet.image import load as load_image
+from pyglet.image.atlas import TextureBin
 
 from physics import Vector
 
@@ -36,11 +43,49 @@ def centre_image(image):
 	image.anchor_y = image.height // 2
 	return image
 
+_assets = {}
+
+def preload(directory="assets", size=1024):
+	"""Pack every image in the directory into a shared texture atlas, centred,
+	so :func:`asset` is just a lookup and sprites can share a texture. Should
+	be called once, at startup.
+	"""
+	names = [name for name in os.listdir(directory) if name.endswith(".png")]
+	loaded = [(name, load_image(os.path.join(directory, name))) for name in names]
+	# Tallest first packs the atlas's rows more tightly.
+	loaded.sort(key=lambda item: (item[1].height, item[1].width), reverse=True)
+	textures = TextureBin(size, size)
+	for name, image in loaded:
+		_assets[name] = centre_image(textures.add(image))
+
+def asset(name):
+	"""The centred image for the named asset, from the atlas if it has been
+	preloaded.
+	"""
+	try:
+		return _assets[name]
+	except KeyError:
+		image = _assets[name] = centre_image(resource.image(name))
+		return image
+
+def write_array(target, values):
+	"""Copy a NumPy array into a vertex list attribute (e.g:
+	``vertex_list.vertices``) in one go. The array must match the attribute's
+	type and size.
+	"""
+	values = numpy.ascontiguousarray(values)
+	ctypes.memmove(target, values.ctypes.data, values.nbytes)
+
 class Camera(object):
 
-	def __init__(self, size, world_size, speed, drag_speed):
+	def __init__(self, size, world_size, speed, drag_speed, margin=100):
+		"""
+		:param margin: How far outside the view things still count as visible,
+		               so they don't pop in at the edges.
+		"""
 		self.size = size
 		self.world_size = world_size
+		self.margin = margin
 		self._x = 0
 		self._y = 0
 		self.movement = Vector(0, 0)
@@ -81,6 +126,20 @@ class Camera(object):
 		self.move(self.dragged)
 		self.dragged = Vector(0, 0)
 
+	def bounds(self, margin=None):
+		"""The visible part of the world, plus the margin, as
+		``(left, bottom, right, top)``.
+		"""
+		if margin is None:
+			margin = self.margin
+		return (self.x-margin, self.y-margin,
+		        self.x+self.size.width+margin, self.y+self.size.height+margin)
+
+	def in_view(self, x, y, radius=0):
+		"""Whether a circle at the given world position is (nearly) visible."""
+		left, bottom, right, top = self.bounds(self.margin+radius)
+		return left < x < right and bottom < y < top
+
 	def translate(self, x, y):
 		return self.x+x, self.y+y
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+Runs scenes without a window or GL context, as fast as the CPU allows.
+Useful for soak-testing, benchmarking and fast-forwarding the simulation.
+"""
+
+from __future__ import division
+
+import argparse
+from timeit import default_timer
+
+import pyglet
+pyglet.options["shadow_window"] = False
+
+from physics import Size
+import scenes
+import snapshot
+
+class Window(object):
+	"""Stands in for :class:`main.Game` where a scene expects a window."""
+
+	headless = True
+
+	CURSOR_DEFAULT = None
+	CURSOR_CROSSHAIR = None
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+
+	@property
+	def size(self):
+		return Size(self.width, self.height)
+
+	def get_system_mouse_cursor(self, name):
+		return None
+
+	def set_mouse_cursor(self, cursor):
+		pass
+
+class Runner(object):
+	"""Drives a scene with a fixed step, with no clock and no rendering."""
+
+	def __init__(self, first, size=Size(1024, 768), step=1/60):
+		"""
+		:param first: The first scene to begin on.
+		:param size: The size of the (imaginary) rendering space.
+		:param step: The simulated time passed to each update.
+		"""
+		self.window = Window(*size)
+		self.step = step
+		self.steps = 0
+		self.elapsed = 0
+		self.finished = False
+		self.scene = first
+
+	@property
+	def scene(self):
+		return self._scene
+
+	@scene.setter
+	def scene(self, scene):
+		next = scene
+		while next:
+			scene = next
+			next._load(self.window.size, self.window)
+			next = next.next
+		self._scene = scene
+
+	def tick(self):
+		"""Advance the scene by a single step."""
+		self.scene.update(self.step)
+		self.steps += 1
+		if self.scene.next:
+			if self.scene.next is True:
+				self.finished = True
+			else:
+				self.scene = self.scene.next
+
+	def run(self, steps=None, duration=None):
+		"""Step until the given number of steps or wall-clock seconds have
+		passed, or the scenes end. Returns the steps per second achieved.
+		"""
+		start = default_timer()
+		done = 0
+		while not self.finished:
+			if steps is not None and done >= steps:
+				break
+			if duration is not None and default_timer()-start >= duration:
+				break
+			self.tick()
+			done += 1
+		self.elapsed += default_timer()-start
+		return self.steps_per_second
+
+	@property
+	def steps_per_second(self):
+		if not self.elapsed:
+			return 0
+		return self.steps/self.elapsed
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Run the game without a window.")
+	parser.add_argument("--steps", type=int, default=3600,
+		help="Number of fixed steps to simulate.")
+	parser.add_argument("--duration", type=float, default=None,
+		help="Stop after this many seconds of wall-clock time.")
+	parser.add_argument("--load", default=None,
+		help="Start from the belt in this snapshot, rather than generating one.")
+	parser.add_argument("--save", default=None,
+		help="Save the belt to this snapshot at the end of the run.")
+	parser.add_argument("--profile", default=None,
+		help="Profile each phase, dumping the percentiles to this file (.csv or .json).")
+	args = parser.parse_args()
+	if args.profile:
+		scenes.Main.PROFILE = True
+		scenes.Main.PROFILE_DUMP = args.profile
+	runner = Runner(scenes.Main(snapshot=args.load))
+	runner.run(args.steps, args.duration)
+	if args.save and isinstance(runner.scene, scenes.Main):
+		snapshot.save(runner.scene, args.save, background=False)
+	if args.profile and isinstance(runner.scene, scenes.Main):
+		runner.scene.profiler.dump(args.profile)
+		print("\n".join(runner.scene.profiler.report()))
+	print("Simulated "+str(runner.steps)+" steps in "+str(round(runner.elapsed, 2))+
+		"s - "+str(round(runner.steps_per_second, 1))+" steps/second.")
@@ -25,6 +25,7 @@ A game for Ludum Dare #23, produced in 48 hours.
 from __future__ import division
 
 import sys
+import argparse
 
 from pyglet import app
 from pyglet import window
@@ -34,15 +35,24 @@ from pyglet import options
 from pyglet import gl
 
 from scenes import Intro
+from scenes import Main
 from physics import Size
+from graphics import preload
+from replay import Recorder
 
 class Game(window.Window):
 	"""Handles the running of the game."""
-	
-	def __init__(self, first, *args):
+
+	headless = False
+
+	def __init__(self, first, *args, **kwargs):
 		"""
 		:param first: The first scene to begin on.
+		:param recorder: A :class:`replay.Recorder` to record input to, if any.
 		"""
+		self.recorder = kwargs.pop("recorder", None)
+		self.motion = None
+		self.drag = None
 		try:
 			super(Game, self).__init__(*args, config = gl.Config(sample_buffers=1, samples=4))
 		except window.NoSuchConfigException:
@@ -50,6 +60,7 @@ class Game(window.Window):
 			super(Game, self).__init__(*args)
 		resource.path.append("assets")
 		resource.reindex()
+		preload("assets")
 		self.scene = first
 		clock.schedule_interval(self.update, 1/60)
 
@@ -65,37 +76,104 @@ class Game(window.Window):
 			next._load(Size(self.width, self.height), self)
 			next = next.next
 		self._scene = scene
+		if self.recorder:
+			self.recorder.begin(scene)
 
 	def on_draw(self):
 		self.clear()
 		self.scene.draw()
 
 	def update(self, frame_time):
+		self.flush()
 		self.scene.update(frame_time)
 		if self.scene.next:
 			if self.scene.next is True:
 				self.end()
 			self.scene = self.scene.next
 
+	def dispatch(self, name, *args):
+		"""Send an input event to the scene, recording it if we are
+		recording.
+		"""
+		if self.recorder:
+			self.recorder.record(name, *args)
+		getattr(self.scene, name)(*args)
+
+	def flush(self):
+		"""Send on any motion or drag collected since the last flush."""
+		if self.motion:
+			motion, self.motion = self.motion, None
+			self.dispatch("mouse_motion", *motion)
+		if self.drag:
+			drag, self.drag = self.drag, None
+			self.dispatch("mouse_drag", *drag)
+
 	def on_mouse_press(self, x, y, button, modifiers):
-		self.scene.mouse_pressed(x, y, button, modifiers)
+		self.flush()
+		self.dispatch("mouse_pressed", x, y, button, modifiers)
 
 	def on_key_press(self, symbol, modifiers):
-		self.scene.key_pressed(symbol, modifiers)
+		self.flush()
+		self.dispatch("key_pressed", symbol, modifiers)
 
 	def on_key_release(self, symbol, modifiers):
-		self.scene.key_released(symbol, modifiers)
+		self.flush()
+		self.dispatch("key_released", symbol, modifiers)
 
 	def on_mouse_motion(self, x, y, dx, dy):
-		self.scene.mouse_motion(x, y, dx, dy)
+		"""Motion is collected, and sent on as a single event each frame with
+		the latest position and the total movement.
+		"""
+		if self.drag:
+			self.flush()
+		if self.motion:
+			dx += self.motion[2]
+			dy += self.motion[3]
+		self.motion = [x, y, dx, dy]
 
 	def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
-		self.scene.mouse_drag(x, y, dx, dy, buttons, modifiers)
+		"""Collected like motion, as long as the buttons and modifiers held
+		don't change.
+		"""
+		if self.motion or (self.drag and self.drag[4:] != [buttons, modifiers]):
+			self.flush()
+		if self.drag:
+			dx += self.drag[2]
+			dy += self.drag[3]
+		self.drag = [x, y, dx, dy, buttons, modifiers]
 
 	def end(self):
+		self.finish()
 		sys.exit()
 
-#options['debug_gl'] = False
-window = Game(Intro(), 1024, 768, "Asteroid Belt - Lattyware's Ludum Dare #23 Entry")
-app.run()
-
+	def on_close(self):
+		self.finish()
+		super(Game, self).on_close()
+
+	def finish(self):
+		if self.recorder:
+			self.recorder.save()
+			self.recorder = None
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Play Asteroid Belt.")
+	parser.add_argument("--record", default=None,
+		help="Record the game's input to this file, to be replayed with replay.py.")
+	parser.add_argument("--profile", default=None,
+		help="Start with the profiler on, dumping it to this file (.csv or .json).")
+	parser.add_argument("--remote-physics", action="store_true",
+		help="Step the physics in a separate process.")
+	args = parser.parse_args()
+	if args.record and args.remote_physics:
+		# The worker steps on its own clock and takes input whenever it
+		# arrives, so there is no step to stamp input with.
+		parser.error("--record can't be used with --remote-physics, as the physics wouldn't replay exactly.")
+	if args.profile:
+		Main.PROFILE = True
+		Main.PROFILE_DUMP = args.profile
+	Main.REMOTE_PHYSICS = args.remote_physics
+
+	#options['debug_gl'] = False
+	window = Game(Intro(), 1024, 768, "Asteroid Belt - Lattyware's Ludum Dare #23 Entry",
+		recorder=Recorder(args.record) if args.record else None)
+	app.run()
@@ -22,8 +22,15 @@ Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
 Just some helper classes.
 """
 
+from __future__ import division
+
 import math as maths
 from collections import namedtuple
+from collections import deque
+from timeit import default_timer
+
+import numpy
+from pymunk import BB
 
 Size = namedtuple("Size", ["width", "height"])
 
@@ -66,8 +73,307 @@ class Vector(object):
 		return "Vector("+str(self.x)+", "+str(self.y)+")"
 
 	def closest(self, others):
+		closest = None
 		minimum = None
 		for other in others:
-			if not minimum or (self-other) < minimum:
-				minimum = other
-		return minimum
+			distance = (self-other).magnitude_sq
+			if minimum is None or distance < minimum:
+				closest = other
+				minimum = distance
+		return closest
+
+class VectorArray(object):
+	"""Many vectors at once, stored as separate arrays of x and y components.
+
+	Operations act on every vector in a single pass rather than allocating a
+	:class:`Vector` each. The other operand may be another VectorArray of the
+	same length, or a single :class:`Vector` (or ``(x, y)`` pair), which is
+	applied to every vector.
+	"""
+
+	def __init__(self, x, y):
+		self.x = numpy.asarray(x, dtype=numpy.float64)
+		self.y = numpy.asarray(y, dtype=numpy.float64)
+
+	@classmethod
+	def zeros(cls, n):
+		return cls(numpy.zeros(n), numpy.zeros(n))
+
+	@classmethod
+	def from_vectors(cls, vectors):
+		points = numpy.array([(vector[0], vector[1]) for vector in vectors], dtype=numpy.float64).reshape(-1, 2)
+		return cls(points[:, 0], points[:, 1])
+
+	def __len__(self):
+		return len(self.x)
+
+	def __getitem__(self, item):
+		if isinstance(item, (int, numpy.integer)):
+			return Vector(float(self.x[item]), float(self.y[item]))
+		return VectorArray(self.x[item], self.y[item])
+
+	def __iter__(self):
+		for x, y in zip(self.x, self.y):
+			yield Vector(float(x), float(y))
+
+	@staticmethod
+	def _components(other):
+		if isinstance(other, VectorArray):
+			return other.x, other.y
+		return other[0], other[1]
+
+	def __add__(self, other):
+		x, y = self._components(other)
+		return VectorArray(self.x+x, self.y+y)
+
+	def __sub__(self, other):
+		x, y = self._components(other)
+		return VectorArray(self.x-x, self.y-y)
+
+	def __mul__(self, scalar):
+		"""Scale by a single number, or by one number per vector."""
+		return VectorArray(self.x*scalar, self.y*scalar)
+
+	def __iadd__(self, other):
+		x, y = self._components(other)
+		self.x += x
+		self.y += y
+		return self
+
+	def __isub__(self, other):
+		x, y = self._components(other)
+		self.x -= x
+		self.y -= y
+		return self
+
+	def __imul__(self, scalar):
+		self.x *= scalar
+		self.y *= scalar
+		return self
+
+	@property
+	def magnitude_sq(self):
+		return self.x*self.x+self.y*self.y
+
+	@property
+	def magnitude(self):
+		return numpy.sqrt(self.magnitude_sq)
+
+	def normalised(self):
+		"""Unit vectors in the same directions. Zero vectors stay zero."""
+		magnitude = self.magnitude
+		scale = numpy.divide(1, magnitude, out=numpy.zeros_like(magnitude), where=magnitude > 0)
+		return self*scale
+
+	def closest(self, point):
+		"""The index of the vector nearest to the given point, or None if
+		there are no vectors.
+		"""
+		if not len(self):
+			return None
+		x, y = self._components(point)
+		return int(numpy.argmin((self.x-x)**2+(self.y-y)**2))
+
+	def __repr__(self):
+		return "VectorArray("+str(len(self))+" vectors)"
+
+class SpatialIndex(object):
+	"""Finds the objects at a point or in a box in sub-linear time.
+
+	This asks the space's own spatial hash, rather than keeping a second
+	structure, so it stays correct as bodies move. Objects are registered by
+	their ``shape`` attribute, which must already be in the space.
+	"""
+
+	def __init__(self, space):
+		self.space = space
+		self.owners = {}
+
+	def add(self, owner):
+		self.owners[owner.shape] = owner
+
+	def remove(self, owner):
+		del self.owners[owner.shape]
+
+	def __len__(self):
+		return len(self.owners)
+
+	def at(self, x, y):
+		"""The first registered object whose shape contains the point, or
+		None.
+		"""
+		for shape in self.space.point_query((x, y)):
+			owner = self.owners.get(shape)
+			if owner:
+				return owner
+		return None
+
+	def within(self, left, bottom, right, top):
+		"""All registered objects whose shapes overlap the box."""
+		owners = self.owners
+		return [owners[shape] for shape in self.space.bb_query(BB(left, bottom, right, top)) if shape in owners]
+
+class PhysicsConfig(object):
+	"""Tuning for a :class:`pymunk.Space` - its spatial hash, solver
+	iterations, and when idle bodies are put to sleep so they stop being
+	solved every step.
+	"""
+
+	# Solver iterations, seconds idle before sleeping, the speed below which a
+	# body is idle (as a fraction of the smallest asteroid per second), and
+	# whether to use a spatial hash sized for the belt rather than chipmunk's
+	# bounding box tree. On a drifting belt a hash only keeps up with the tree
+	# with cells around four asteroids across - smaller cells were up to five
+	# times slower. Belts drift at ~35-75px/s, so hardly any body is ever idle
+	# while they drift, and sleeping then costs more in contact graph upkeep
+	# than it saves - only "settled", for belts that have come to rest, sleeps,
+	# and it keeps the tree, which skips sleeping bodies far better than a hash.
+	PRESETS = {
+		"accurate": (20, float("inf"), 0, False),
+		"balanced": (10, float("inf"), 0, True),
+		"fast": (5, float("inf"), 0, True),
+		"settled": (10, 0.5, 0.1, False),
+	}
+
+	def __init__(self, cell_size=None, count=None, iterations=10, sleep_time=float("inf"), idle_speed=0):
+		"""
+		:param cell_size: The size of a cell in the spatial hash. Works best
+		                  around the size of a typical shape. None keeps the
+		                  space's default broadphase.
+		:param count: The number of cells in the spatial hash. Works best
+		              around ten times the number of shapes.
+		:param iterations: Solver iterations per step - more is more accurate.
+		:param sleep_time: Seconds a group of bodies must be idle before it is
+		                   put to sleep. Infinity disables sleeping.
+		:param idle_speed: Bodies slower than this are idle. 0 lets the space
+		                   pick a speed based on gravity, so nothing is idle
+		                   without gravity.
+		"""
+		self.cell_size = cell_size
+		self.count = count
+		self.iterations = iterations
+		self.sleep_time = sleep_time
+		self.idle_speed = idle_speed
+
+	@classmethod
+	def for_asteroids(cls, minimum, maximum, count, preset="balanced"):
+		"""A configuration for a belt of the given number of asteroids, of
+		sizes in the given range (as given to :func:`generation.layout`).
+		"""
+		iterations, sleep_time, idle, hashed = cls.PRESETS[preset]
+		cell_size = None
+		if hashed:
+			# Asteroids collide with a radius of 1.1 times their size, so this
+			# is four of an average asteroid across.
+			cell_size = 4*2.2*(minimum+maximum)/2
+		return cls(cell_size, max(1000, count*10), iterations, sleep_time, idle*minimum)
+
+	def apply(self, space):
+		space.iterations = self.iterations
+		if self.cell_size is not None:
+			_use_spatial_hash(space, self.cell_size, self.count)
+		space.sleep_time_threshold = self.sleep_time
+		space.idle_speed_threshold = self.idle_speed
+
+	def __repr__(self):
+		return ("PhysicsConfig(cell_size="+str(self.cell_size)+", count="+str(self.count)+
+			", iterations="+str(self.iterations)+", sleep_time="+str(self.sleep_time)+
+			", idle_speed="+str(self.idle_speed)+")")
+
+def _use_spatial_hash(space, cell_size, count):
+	"""Switch a space's broadphase to a spatial hash, with whichever call the
+	installed pymunk has.
+	"""
+	if hasattr(space, "use_spatial_hash"):
+		space.use_spatial_hash(cell_size, count)
+	elif hasattr(space, "resize_active_hash"):
+		space.resize_active_hash(cell_size, count)
+	else:
+		# Some builds only have the binding.
+		from pymunk import _chipmunk
+		_chipmunk.cpSpaceUseSpatialHash(space._space, cell_size, count)
+
+class FixedTimestep(object):
+	"""Advances a simulation in fixed steps, however long frames take.
+
+	Frame time is accumulated and consumed a step at a time, with each step
+	split into substeps. No more than ``max_steps`` are taken in one frame -
+	time beyond that is dropped, rather than spiralling into ever-longer
+	catch-up frames. ``alpha`` is how far the frame falls between the last
+	step and the next, and ``previous`` is the state of the bodies before the
+	last step, for interpolating what is drawn between the two - see
+	:func:`entities.interpolate`.
+	"""
+
+	def __init__(self, step=1/60, substeps=1, max_steps=5, history=120, bodies=None):
+		"""
+		:param step: The simulated time per step.
+		:param substeps: How many physics steps each step is split into.
+		:param max_steps: The most steps that will be taken in one frame.
+		:param history: How many step timings are kept for :func:`stats`.
+		:param bodies: Called with no arguments for the bodies whose state is
+		               kept in ``previous`` - nothing is kept if not given.
+		"""
+		self.bodies = bodies
+		self.previous = {}
+		self.step = step
+		self.substeps = substeps
+		self.max_steps = max_steps
+		self.accumulator = 0
+		self.alpha = 0
+		self.steps = 0
+		self.total_steps = 0
+		self.dropped = 0
+		self.timings = deque(maxlen=history)
+
+	def advance(self, frame_time, update, step):
+		"""Consume the frame's time.
+
+		:param update: Called with no arguments once per step, for game logic.
+		:param step: Called with the substep length for each substep, to step
+		             the physics.
+		:return: The number of steps taken.
+		"""
+		self.accumulator += frame_time
+		substep = self.step/self.substeps
+		due = min(int(self.accumulator//self.step), self.max_steps)
+		steps = 0
+		while steps < due:
+			if self.bodies and steps == due-1:
+				# Only the last step's starting point is ever drawn.
+				self.previous = body_states(self.bodies())
+			start = default_timer()
+			update()
+			for _ in range(self.substeps):
+				step(substep)
+			self.timings.append(default_timer()-start)
+			self.accumulator -= self.step
+			steps += 1
+		if self.accumulator >= self.step:
+			dropped = self.accumulator-self.accumulator % self.step
+			self.dropped += dropped
+			self.accumulator -= dropped
+		self.alpha = self.accumulator/self.step
+		self.steps = steps
+		self.total_steps += steps
+		return steps
+
+	def stats(self):
+		"""Timing for recent steps, in seconds."""
+		timings = self.timings
+		return {
+			"steps": self.steps,
+			"total_steps": self.total_steps,
+			"dropped": self.dropped,
+			"last": timings[-1] if timings else 0,
+			"mean": sum(timings)/len(timings) if timings else 0,
+			"max": max(timings) if timings else 0,
+		}
+
+def body_states(bodies):
+	"""The ``(x, y, angle)`` of each of the bodies, keyed by body."""
+	states = {}
+	for body in bodies:
+		x, y = body.position
+		states[body] = x, y, body.angle
+	return states
@@ -0,0 +1,147 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+
+Timing the phases of each frame.
+
+Each phase's time is totalled over a frame, then kept in a fixed-size ring
+buffer, so percentiles over the last few seconds are cheap to work out at any
+point. When profiling is off, :data:`NULL` stands in, and timing a phase costs
+no more than entering an empty ``with`` block.
+"""
+
+from __future__ import division
+
+import csv
+import json
+from timeit import default_timer
+
+import numpy
+
+PERCENTILES = 50, 95, 99
+
+class Profiler(object):
+	"""Times named phases, and keeps the last ``size`` frames of each."""
+
+	enabled = True
+
+	def __init__(self, phases, size=600, path=None, interval=10):
+		"""
+		:param phases: The names of the phases, in the order to report them.
+		:param size: How many frames to keep timings for.
+		:param path: Where to dump the percentiles every ``interval``
+		             seconds, if anywhere - as JSON if the path ends in
+		             ``.json``, otherwise as CSV.
+		"""
+		self.phases = list(phases)
+		self.size = size
+		self.buffers = numpy.zeros((len(self.phases), size))
+		self.indices = {name: i for i, name in enumerate(self.phases)}
+		self.current = [0.0]*len(self.phases)
+		self.frames = 0
+		self.path = path
+		self.interval = interval
+		self.last_dump = default_timer()
+
+	def phase(self, name):
+		"""A context manager that adds the time spent in it to the phase."""
+		return _Timer(self.current, self.indices[name])
+
+	def frame(self):
+		"""End the current frame, storing its timings, and dumping them if it
+		is time to.
+		"""
+		self.buffers[:, self.frames % self.size] = self.current
+		self.current[:] = [0.0]*len(self.phases)
+		self.frames += 1
+		if self.path and default_timer()-self.last_dump >= self.interval:
+			self.dump(self.path)
+
+	def percentiles(self):
+		"""The percentiles of each phase's time over the stored frames, in
+		seconds, as ``{phase: (p50, p95, p99)}``.
+		"""
+		filled = self.buffers[:, :min(self.frames, self.size)]
+		if not filled.shape[1]:
+			return {name: (0,)*len(PERCENTILES) for name in self.phases}
+		values = numpy.percentile(filled, PERCENTILES, axis=1)
+		return {name: tuple(values[:, i].tolist()) for i, name in enumerate(self.phases)}
+
+	def report(self):
+		"""The percentiles as lines of text, in milliseconds."""
+		percentiles = self.percentiles()
+		width = max(len(name) for name in self.phases)
+		lines = ["".ljust(width)+"".join(("p"+str(p)).rjust(9) for p in PERCENTILES)]
+		for name in self.phases:
+			lines.append(name.ljust(width)+"".join(("%.3f" % (value*1000)).rjust(9) for value in percentiles[name]))
+		return lines
+
+	def dump(self, path):
+		percentiles = self.percentiles()
+		if path.endswith(".json"):
+			with open(path, "w") as file:
+				json.dump({"frames": self.frames, "percentiles": list(PERCENTILES), "phases": percentiles}, file, indent=1)
+		else:
+			with open(path, "w") as file:
+				writer = csv.writer(file)
+				writer.writerow(["phase"]+["p"+str(p) for p in PERCENTILES])
+				for name in self.phases:
+					writer.writerow([name]+list(percentiles[name]))
+		self.last_dump = default_timer()
+
+class _Timer(object):
+
+	__slots__ = ("totals", "index", "start")
+
+	def __init__(self, totals, index):
+		self.totals = totals
+		self.index = index
+
+	def __enter__(self):
+		self.start = default_timer()
+
+	def __exit__(self, *exc_info):
+		self.totals[self.index] += default_timer()-self.start
+
+class NullProfiler(object):
+	"""Stands in for a :class:`Profiler` when profiling is off."""
+
+	enabled = False
+
+	def phase(self, name):
+		return _NULL_TIMER
+
+	def frame(self):
+		pass
+
+class _NullTimer(object):
+
+	__slots__ = ()
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *exc_info):
+		pass
+
+_NULL_TIMER = _NullTimer()
+
+NULL = NullProfiler()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+
+Running the physics in a separate process.
+
+The worker process runs a headless :class:`scenes.Main`, seeded from a snapshot
+of the scene being shown, and steps it on its own clock. After each step it
+publishes the position, angle and velocity of the player and every active
+asteroid into a double-buffered block of shared memory, which the rendering
+side reads in place. Anything that changes the simulation - the player's
+target, impulses and new joints - is sent across as a command.
+"""
+
+from __future__ import division
+
+import os
+import time
+import atexit
+import ctypes
+import tempfile
+import multiprocessing
+from timeit import default_timer
+
+try:
+	from Queue import Empty
+except ImportError:
+	from queue import Empty
+
+import numpy
+
+import snapshot
+from physics import body_states
+
+# A body's state, as from snapshot.body_state, and whether the row has been
+# written.
+FIELDS = 7
+
+def joint_key(joint):
+	"""Identifies a joint the same way in both processes."""
+	(a, b) = joint.asteroids
+	return (snapshot.JOINTS.index(type(joint)), a.id, b.id)+tuple(joint.constraint.anchr1)+tuple(joint.constraint.anchr2)
+
+class Transforms(object):
+	"""A double-buffered table of body states in shared memory, with a row
+	for each asteroid in the layout and one more for the player.
+
+	The writer fills the back buffer, then bumps the sequence number to make
+	it the front. Readers check which sequence is being written after
+	reading, so they can tell if the writer lapped them and started writing
+	over what they read.
+	"""
+
+	def __init__(self, rows):
+		self.rows = rows
+		self.data = multiprocessing.RawArray(ctypes.c_double, 2*rows*FIELDS)
+		self.sequence = multiprocessing.RawValue(ctypes.c_long, 0)
+		self.writing = multiprocessing.RawValue(ctypes.c_long, 0)
+		self.published = multiprocessing.RawValue(ctypes.c_double, 0)
+		self._views = None
+
+	@property
+	def views(self):
+		# Made lazily, as numpy views can't be sent to the worker.
+		if self._views is None:
+			data = numpy.frombuffer(self.data, dtype=numpy.float64).reshape(2, self.rows, FIELDS)
+			self._views = data[0], data[1]
+		return self._views
+
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state["_views"] = None
+		return state
+
+	def write(self, rows, states):
+		"""Publish the states of the given rows - rows not given keep
+		whatever they last had in this buffer.
+		"""
+		sequence = self.sequence.value
+		self.writing.value = sequence+1
+		back = self.views[(sequence+1) % 2]
+		back[rows, :FIELDS-1] = states
+		back[rows, FIELDS-1] = 1
+		self.published.value = time.time()
+		self.sequence.value = sequence+1
+
+	def read(self):
+		"""The front buffer, without copying, and its sequence number."""
+		sequence = self.sequence.value
+		return self.views[sequence % 2], sequence
+
+	def lapped(self, sequence):
+		"""Whether the buffer for the given sequence may have been written
+		over since it was read.
+		"""
+		return self.writing.value >= sequence+2
+
+class RemotePhysics(object):
+	"""The rendering side's link to a physics worker for a scene.
+
+	The scene's own space is never stepped - each frame :func:`update` copies
+	the published states onto its bodies instead, so drawing, picking and the
+	joint lines work just as they would otherwise. Like a
+	:class:`physics.FixedTimestep`, it keeps the ``previous`` states of the
+	bodies and how far (``alpha``) the frame is from them to the latest, so
+	drawing is interpolated between the last two published steps.
+	"""
+
+	def __init__(self, scene):
+		self.scene = scene
+		self.step = scene.timestep.step
+		handle, self.path = tempfile.mkstemp(suffix=".belt")
+		os.close(handle)
+		snapshot.save(scene, self.path, background=False)
+		self.player = len(scene.layout)
+		self.transforms = Transforms(self.player+1)
+		self.commands = multiprocessing.Queue()
+		self.events = multiprocessing.Queue()
+		self.joints = {joint_key(joint): joint for joint in scene.constraints}
+		self.target = None
+		self.sequence = 0
+		self.previous = {}
+		self.alpha = 1
+		self.process = multiprocessing.Process(target=_run,
+			args=(self.path, self.transforms, self.commands, self.events, self.step))
+		self.process.daemon = True
+		self.process.start()
+		atexit.register(self.stop)
+
+	def join(self, joint):
+		"""Send a newly made joint over."""
+		key = joint_key(joint)
+		self.joints[key] = joint
+		self.commands.put(("join", key))
+
+	def impulse(self, asteroid, impulse, offset=(0, 0)):
+		self.commands.put(("impulse", asteroid.id, tuple(impulse), tuple(offset)))
+
+	def update(self):
+		"""Send the player's target over, snap joints that snapped over there,
+		and copy the latest published states onto the scene's bodies.
+		"""
+		scene = self.scene
+		if scene.mouse != self.target:
+			self.target = scene.mouse
+			self.commands.put(("target",)+tuple(self.target))
+		snapped = []
+		while True:
+			try:
+				event = self.events.get_nowait()
+			except Empty:
+				break
+			if event[0] == "snapped":
+				joint = self.joints.pop(event[1], None)
+				if joint and joint in scene.constraints:
+					snapped.append(joint)
+		if snapped:
+			scene.constraints.snap(snapped)
+		front, sequence = self.transforms.read()
+		if sequence == self.sequence:
+			self.alpha = self.since_published()
+			return
+		asteroids = [asteroid for asteroid in scene.chunks if asteroid.active]
+		ids = numpy.fromiter((asteroid.id for asteroid in asteroids), dtype=numpy.intp, count=len(asteroids))
+		states = numpy.array(front[numpy.append(ids, self.player)])
+		if self.transforms.lapped(sequence):
+			# The worker wrote over this buffer as we read it - wait for the next.
+			return
+		self.sequence = sequence
+		self.alpha = self.since_published()
+		self.previous = body_states([asteroid.body for asteroid in asteroids]+[scene.player.body])
+		for asteroid, state in zip(asteroids, states[:-1].tolist()):
+			if state[-1]:
+				snapshot.set_body_state(asteroid.body, state[:-1])
+		if states[-1, -1]:
+			snapshot.set_body_state(scene.player.body, states[-1, :-1].tolist())
+
+	def since_published(self):
+		"""How far through a step it has been since the latest states were
+		published, from 0 to 1.
+		"""
+		return max(0, min(1, (time.time()-self.transforms.published.value)/self.step))
+
+	def stop(self):
+		if self.process.is_alive():
+			self.commands.put(("stop",))
+			self.process.join(1)
+			if self.process.is_alive():
+				self.process.terminate()
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+def _run(path, transforms, commands, events, step, max_steps=5):
+	"""The worker - runs a headless copy of the scene on its own clock."""
+	import headless
+	import scenes
+	scenes.Main.REMOTE_PHYSICS = False
+	# The runner only loads the scene - it is then stepped directly, so it is
+	# never swapped for the next one, which would need GL.
+	scene = headless.Runner(scenes.Main(snapshot=path), step=step).scene
+	joints = {joint_key(joint): joint for joint in scene.constraints}
+	player = len(scene.layout)
+	next = default_timer()
+	while not scene.next:
+		while True:
+			try:
+				command = commands.get_nowait()
+			except Empty:
+				break
+			name, args = command[0], command[1:]
+			if name == "stop":
+				return
+			elif name == "target":
+				scene.mouse = args
+			elif name == "impulse":
+				i, impulse, offset = args
+				body = scene.chunks.asteroid(i).body
+				body.activate()
+				body.apply_impulse(impulse, offset)
+			elif name == "join":
+				key = args[0]
+				kind, a, b = key[:3]
+				joint = snapshot.JOINTS[kind](scene.chunks.asteroid(a), scene.chunks.asteroid(b), key[3:5], key[5:7], scene.space)
+				scene.constraints.add(joint)
+				joints[key] = joint
+		count = len(scene.constraints)
+		scene.update(step)
+		if len(scene.constraints) < count:
+			for key in [key for key, joint in joints.items() if joint not in scene.constraints]:
+				del joints[key]
+				events.put(("snapped", key))
+		asteroids = [asteroid for asteroid in scene.chunks if asteroid.active]
+		rows = numpy.fromiter((asteroid.id for asteroid in asteroids), dtype=numpy.intp, count=len(asteroids))
+		states = [snapshot.body_state(asteroid.body) for asteroid in asteroids]
+		states.append(snapshot.body_state(scene.player.body))
+		transforms.write(numpy.append(rows, player), numpy.array(states, dtype=numpy.float64))
+		next += step
+		now = default_timer()
+		if now-next > max_steps*step:
+			next = now
+		elif next > now:
+			time.sleep(next-now)
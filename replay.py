@@ -0,0 +1,198 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+Recording the input to a game, and replaying it.
+
+A recording holds, for each seeded scene played, its seed and every input
+event it received, stamped with the number of fixed steps that had been taken
+when it arrived. As the simulation only moves forward a step at a time, feeding
+the same events in before the same steps reproduces the run exactly, which
+lets a replay be run headlessly as fast as the CPU allows.
+"""
+
+from __future__ import division
+
+import json
+import argparse
+from heapq import nlargest
+from timeit import default_timer
+
+import scenes
+from physics import Size
+
+VERSION = 1
+
+class ReplayError(Exception):
+	pass
+
+def steps_taken(scene):
+	timestep = getattr(scene, "timestep", None)
+	return timestep.total_steps if timestep else 0
+
+class Recorder(object):
+	"""Records the input sent to scenes, to be saved and replayed later. Only
+	scenes with a ``seed`` can be replayed, so others are ignored. A scene
+	loaded from a snapshot needs that snapshot, unchanged, to be replayed.
+	"""
+
+	def __init__(self, path):
+		"""
+		:param path: Where the recording is saved.
+		"""
+		self.path = path
+		self.recordings = []
+		self.scene = None
+		self.current = None
+		self.start = 0
+
+	def begin(self, scene):
+		"""Start recording a newly loaded scene."""
+		self.finish()
+		self.scene = scene
+		self.current = None
+		if getattr(scene, "seed", None) is None:
+			return
+		self.start = default_timer()
+		self.current = {
+			"scene": type(scene).__name__,
+			"seed": scene.seed,
+			"snapshot": getattr(scene, "snapshot", None),
+			"size": list(scene.size),
+			"events": [],
+		}
+		self.recordings.append(self.current)
+
+	def record(self, name, *args):
+		"""Record an event about to be sent to the current scene.
+
+		The camera's position is kept with each event, as mouse positions are
+		translated through it, and it follows the (interpolated) player - so
+		depends on frame timing rather than just the steps taken.
+		"""
+		if self.current is None:
+			return
+		camera = getattr(self.scene, "camera", None)
+		self.current["events"].append([
+			steps_taken(self.scene),
+			round(default_timer()-self.start, 4),
+			name,
+			list(args),
+			[camera.x, camera.y] if camera else None,
+		])
+
+	def finish(self):
+		"""Note how many steps the current scene ran for, so a replay carries
+		on past its last event for as long as the scene really did.
+		"""
+		if self.current is not None:
+			self.current["steps"] = steps_taken(self.scene)
+
+	def save(self):
+		self.finish()
+		with open(self.path, "w") as file:
+			json.dump({"version": VERSION, "scenes": self.recordings}, file)
+
+def load(path):
+	with open(path) as file:
+		recording = json.load(file)
+	if recording.get("version") != VERSION:
+		raise ReplayError(path+" is not a version "+str(VERSION)+" recording.")
+	return recording["scenes"]
+
+class Replay(object):
+	"""Plays a recorded scene back through a :class:`headless.Runner`."""
+
+	def __init__(self, recording, slowest=5):
+		"""
+		:param recording: One scene's recording, as loaded by :func:`load`.
+		:param slowest: How many of the slowest steps to keep track of.
+		"""
+		self.recording = recording
+		self.events = recording["events"]
+		self.position = 0
+		self.slowest = slowest
+		self.timings = []
+		# Imported here, as importing it turns off pyglet's shadow window,
+		# which the game itself (which records with this module) needs.
+		import headless
+		scene = getattr(scenes, recording["scene"])(seed=recording["seed"], snapshot=recording["snapshot"])
+		self.runner = headless.Runner(scene, Size(*recording["size"]))
+
+	@property
+	def scene(self):
+		return self.runner.scene
+
+	def deliver(self):
+		"""Send every event that arrived before the current step."""
+		scene = self.scene
+		taken = steps_taken(scene)
+		while self.position < len(self.events) and self.events[self.position][0] <= taken:
+			_, _, name, args, camera = self.events[self.position]
+			if camera:
+				scene.camera.x, scene.camera.y = camera
+			getattr(scene, name)(*args)
+			self.position += 1
+
+	def run(self, extra=0):
+		"""Replay every event and every step the scene was recorded running
+		for, then run on for ``extra`` steps. Returns the steps per second
+		achieved.
+		"""
+		scene = self.scene
+		# Recordings from before the step count was kept end at their last
+		# event.
+		end = self.recording.get("steps", 0)
+		remaining = extra
+		began = default_timer()
+		while not self.runner.finished and self.runner.scene is scene:
+			if self.position >= len(self.events) and steps_taken(scene) >= end:
+				if remaining <= 0:
+					break
+				remaining -= 1
+			self.deliver()
+			step = steps_taken(scene)
+			start = default_timer()
+			self.runner.tick()
+			self.timings.append((default_timer()-start, step))
+		self.runner.elapsed += default_timer()-began
+		self.timings = nlargest(self.slowest, self.timings)
+		return self.runner.steps_per_second
+
+def replay(path, extra=0):
+	"""Replay every scene in a recording, printing how fast it went and its
+	slowest steps.
+	"""
+	for recording in load(path):
+		player = Replay(recording)
+		rate = player.run(extra)
+		print(recording["scene"]+" (seed "+str(recording["seed"])+"): "+str(player.runner.steps)+
+			" steps at "+str(round(rate, 1))+" steps/second.")
+		for duration, step in player.timings:
+			print("  step "+str(step).ljust(8)+str(round(duration*1000, 3)).rjust(10)+" ms")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Replay a recorded game without a window.")
+	parser.add_argument("recording",
+		help="The recording to replay, as made by running the game with --record.")
+	parser.add_argument("--extra", type=int, default=0,
+		help="Carry on for this many steps after the last event.")
+	args = parser.parse_args()
+	replay(args.recording, args.extra)
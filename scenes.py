@@ -24,50 +24,124 @@ Segments of the game.
 
 from __future__ import division
 
-from random import choice
-from random import triangular
+import os
+import sys
+import threading
+from random import randint
 from operator import attrgetter
 
 from pyglet import sprite
-from pyglet import resource
 from pyglet import graphics
 from pyglet import window
+from pyglet import text
 
 from pymunk import Body
 from pymunk import Space
 from pymunk import Segment
 from pymunk import BB
 
+import generation
+import snapshot
+import profiler
+from remote import RemotePhysics
 from physics import Size
 from physics import Vector
+from physics import SpatialIndex
+from physics import FixedTimestep
+from physics import PhysicsConfig
 from entities import Stars
-from entities import Asteroid
-from graphics import centre_image
+from world import Chunks
+from entities import ConstraintRenderer
+from entities import Joints
+from entities import AsteroidRenderer
+from entities import EntityStore
+from entities import interpolate
+from graphics import asset
 from graphics import Camera
 from graphics import CameraGroup
 from tools import Tool
 from ui import Button
 from entities import Person
+from entities import Crowd
+
+if sys.version_info[0] >= 3:
+	def _reraise(kind, error, traceback):
+		raise error.with_traceback(traceback)
+else:
+	# Python 2's three argument raise is a syntax error in Python 3.
+	exec("def _reraise(kind, error, traceback):\n\traise kind, error, traceback\n")
 
 class Scene(object):
 	"""A base object for scenes in the game. A scene is a segment of the game -
 	e.g: a menu or a level."""
 
+	progress = 0
+	stage = ""
+	_preparing = None
+	_prepared = False
+	_error = None
+
+	def prepare(self, progress):
+		"""Called to prepare everything the scene needs that doesn't touch
+		GL, which may happen on a worker thread while another scene is shown.
+
+		:param progress: Called with the fraction done so far and a
+						 description of what is happening.
+		"""
+		pass
+
+	def prepare_in_background(self):
+		"""Start preparing the scene on a worker thread. :attr:`progress` and
+		:attr:`stage` say how far it has got, and :attr:`ready` when it's done.
+		"""
+		self._preparing = threading.Thread(target=self._prepare)
+		self._preparing.daemon = True
+		self._preparing.start()
+
+	@property
+	def ready(self):
+		return self._prepared
+
+	def _prepare(self):
+		try:
+			self.prepare(self._progressed)
+		except Exception:
+			# Kept whole, so the traceback survives being raised again on the
+			# main thread.
+			self._error = sys.exc_info()
+		self._prepared = True
+
+	def _progressed(self, fraction, stage):
+		self.progress = fraction
+		self.stage = stage
+
 	def _load(self, size, window):
 		"""Called when the scene needs to be loaded. This will happen just
-		before the scene is displayed to the user. This calls :func:`load`_.
+		before the scene is displayed to the user. This finishes preparing
+		the scene, if that hasn't already happened in the background, then
+		calls :func:`load`_.
 
 		:param size: ``(width, height) collections.namedtuple - the size of the
 					 rendering space.
+		:param window: The window the scene is shown in. If the window is
+					   headless, the scene should not touch GL at all.
 		"""
 		self.size = size
 		self.window = window
+		self.headless = window.headless
 		self.next = False
+		if self._preparing:
+			self._preparing.join()
+		elif not self._prepared:
+			self._prepare()
+		if self._error:
+			_reraise(*self._error)
 		self.load()
 
 	def load(self):
-		"""Called when the scene needs to be loaded. This will happen just
-		before the scene is displayed to the user.
+		"""Called on the main thread when the scene needs to be loaded, once it
+		has been prepared. This will happen just before the scene is displayed
+		to the user.
 		"""
 		raise NotImplementedError
 
@@ -82,7 +156,7 @@ class Scene(object):
 	def mouse_pressed(self, x, y, button, modifiers):
 		raise NotImplementedError
 
-	def key_pressed(self, x, y, symbol, modifiers):
+	def key_pressed(self, symbol, modifiers):
 		raise NotImplementedError
 
 	def mouse_motion(self, x, y, dx, dy):
@@ -100,11 +174,15 @@ class Intro(Scene):
 
 	def load(self):
 		centre = Vector(self.size.width/2, self.size.height/2)
-		image = centre_image(resource.image("lattyware.png"))
+		image = asset("lattyware.png")
 		self.logo = sprite.Sprite(image, centre.x, centre.y)
 		self.logo.opacity = 0
 		self.fade = 0
 		self.fade_in = True
+		self.skipped = False
+		self.loading = text.Label("", font_size=12, x=centre.x, y=centre.y-image.height/2-30, anchor_x="center")
+		self.following = Main()
+		self.following.prepare_in_background()
 
 	def update(self, frame_time):
 		if self.fade_in:
@@ -112,21 +190,25 @@ class Intro(Scene):
 			if self.fade >= 255:
 				self.fade_in = False
 				self.fade = 255
-			self.logo.opacity = self.fade
+		elif self.fade > 0:
+			self.fade = max(0, self.fade-frame_time*Intro.FADE_SPEED)
+		self.logo.opacity = self.fade
+		if self.following.ready:
+			if self.skipped or self.fade <= 0:
+				self.end(self.following)
 		else:
-			self.fade -= frame_time*Intro.FADE_SPEED
-			if self.fade <= 0:
-				self.end(Main())
-			self.logo.opacity = self.fade
+			self.loading.text = self.following.stage+"... "+str(int(self.following.progress*100))+"%"
 
 	def draw(self):
 		self.logo.draw()
+		if not self.following.ready:
+			self.loading.draw()
 
 	def mouse_pressed(self, x, y, button, modifiers):
-		self.end(Main())
+		self.skipped = True
 
-	def key_pressed(self, x, y, symbol, modifiers):
-		self.end(Main())
+	def key_pressed(self, symbol, modifiers):
+		self.skipped = True
 
 	def mouse_motion(self, x, y, dx, dy):
 		pass
@@ -137,24 +219,51 @@ class Intro(Scene):
 class Main(Scene):
 
 	FADE_SPEED = 75
+	STEP = 1/60
+	SUBSTEPS = 1
+	MAX_STEPS = 5
+	CHUNK = 2048
+	SIZES = 50, 100
+	PHYSICS = "balanced"
+	QUICKSAVE = "quicksave.belt"
+	PHASES = "fade", "chunks", "win", "person", "space.step", "constraints", "camera", "render", "draw"
+	PROFILE = False # Whether to start with the profiler on - F3 toggles it.
+	PROFILE_DUMP = "profile.csv" # Written every few seconds while profiling.
+	REMOTE_PHYSICS = False # Whether to step the physics in another process.
+	PLANET_HEIGHT = 100 # planet.png, known up front so headless runs agree.
+
+	def __init__(self, seed=None, snapshot=None):
+		"""
+		:param seed: The seed the world is generated from. The same seed
+		             always gives the same belt.
+		:param snapshot: The path of a snapshot to load the belt from, rather
+		                 than generating it.
+		"""
+		self.seed = seed
+		self.snapshot = snapshot
 
-	def load(self):
-		self.world_size = Size(3000, 3000)
-
-		self.camera = Camera(self.size, self.world_size, 1000, 10)
-
-		self._tool = None
-		self.tool = None
-
-		self.batch = graphics.Batch()
-		self.background = CameraGroup(graphics.OrderedGroup(0), self.camera)
-		self.foreground = CameraGroup(graphics.OrderedGroup(1), self.camera)
-		self.playerg = CameraGroup(graphics.OrderedGroup(2), self.camera)
-		self.world_ui = CameraGroup(graphics.OrderedGroup(3), self.camera)
-		self.ui = graphics.OrderedGroup(2)
+	def prepare(self, progress):
+		"""Read or generate the belt and set up the space, ready for the
+		asteroids to be created in :func:`load`.
+		"""
+		self.saved = None
+		if self.snapshot:
+			progress(0, "Reading the belt")
+			header, arrays = self.saved = snapshot.read(self.snapshot)
+			self.seed = header["seed"]
+			self.world_size = Size(*header["world_size"])
+			# Older snapshots didn't save their stars.
+			self.star_seed = header.get("star_seed")
+		else:
+			if self.seed is None:
+				self.seed = randint(0, 2**31-1)
+			self.world_size = Size(3000, 3000)
+			self.star_seed = None
 
+		progress(0.05, "Setting up physics")
 		self.space = Space()
 		self.space.gravity = (0.0, 0.0)
+		self.timestep = FixedTimestep(Main.STEP, Main.SUBSTEPS, Main.MAX_STEPS)
 		buffer = 100
 		borders = Body()
 		borders.position = (0, 0)
@@ -166,48 +275,104 @@ class Main(Scene):
 			(-buffer, self.world_size.height+buffer), buffer)
 		self.space.add_static(left, bottom, right, top)
 
-		self.stars = Stars(self.world_size, self.batch, self.background)
+		progress(0.1, "Generating the belt")
+		if self.saved:
+			self.layout = snapshot.layout(*self.saved)
+		else:
+			self.layout = generation.layout(self.world_size, Main.SIZES[0], Main.SIZES[1], self.seed,
+				progress=lambda done: progress(0.1+0.8*done, "Generating the belt"))
+		PhysicsConfig.for_asteroids(Main.SIZES[0], Main.SIZES[1], len(self.layout), Main.PHYSICS).apply(self.space)
+
+		progress(0.9, "Scattering stars")
+		if self.star_seed is None:
+			self.star_seed = randint(0, 2**31-1)
+		Stars.field(self.world_size, self.star_seed)
+		progress(1, "Ready")
 
-		self.asteroids = Asteroid.populate(50, 100, self.world_size, self.batch, self.foreground, self.space)
+	def load(self):
+		self.camera = Camera(self.size, self.world_size, 1000, 10)
 
-		if not self.asteroids:
-			print("None of a particular resource on this asteroid belt, that'd be unfair. Trying again.")
-			self.end(Main())
-			return
+		self._tool = None
+		self.tool = None
+
+		self.batch = None if self.headless else graphics.Batch()
+		self.background = CameraGroup(graphics.OrderedGroup(0), self.camera)
+		self.foreground = CameraGroup(graphics.OrderedGroup(1), self.camera)
+		self.playerg = CameraGroup(graphics.OrderedGroup(2), self.camera)
+		self.world_ui = CameraGroup(graphics.OrderedGroup(3), self.camera)
+		self.ui = graphics.OrderedGroup(2)
+
+		self.stars = Stars(self.world_size, self.batch, self.background, self.star_seed)
 
-		self.home_world = choice([asteroid for asteroid in self.asteroids if asteroid.position.y > self.world_size.height/4*3])
-		self.home_world.type = "home"
+		self.outlines = graphics.OrderedGroup(0, self.foreground)
+		self.icons = graphics.OrderedGroup(1, self.foreground)
+
+		self.index = SpatialIndex(self.space)
+		self.store = EntityStore(pool=self.layout.pool)
+		self.renderer = None
+		if not self.headless:
+			self.renderer = AsteroidRenderer(self.batch, self.outlines, self.layout.pool, self.store)
+		self.chunks = Chunks(self.layout, self.space, self.index, self.renderer, self.batch, self.icons, Main.CHUNK, store=self.store)
+
+		self.home_world = self.chunks.asteroid(self.layout.home)
 		self.home_world.populated = True
 
 		x, y = self.home_world.position
 		self.camera.move(Vector(x-self.size.width/2, y-self.size.height/2))
+		self.chunks.update(x, y)
 
-		# Let's make stuff a bit more interesting.
-		for asteroid in self.asteroids:
-			if not asteroid.type == "home":
-				asteroid.body.apply_impulse((triangular(-20000, 20000, 0), triangular(-20000, 20000, 0)))
-
-		x, y = self.home_world.position
 		self.player = Person(x+150, y+150, self.batch, self.playerg, self.space)
+		self.crowd = Crowd([self.player])
 		self.mouse = x+150, y+150
 
-		centre = Vector(self.size.width/2, self.size.height/2)
-		image = centre_image(resource.image("logo.png"))
-		self.logo = sprite.Sprite(image, centre.x, centre.y, batch=self.batch, group=self.ui)
-		self.logo.opacity = 255
 		self.fade = True
-		self.faded = False
+		self.faded = self.headless
+		if not self.headless:
+			centre = Vector(self.size.width/2, self.size.height/2)
+			image = asset("logo.png")
+			self.logo = sprite.Sprite(image, centre.x, centre.y, batch=self.batch, group=self.ui)
+			self.logo.opacity = 255
 
-		planet = centre_image(resource.image("planet.png"))
 		x = self.world_size.width/2
-		y = planet.height/2
-		self.planet_sprite = sprite.Sprite(planet, x, y, batch=self.batch, group=self.world_ui)
+		y = Main.PLANET_HEIGHT/2
+		self.planet = Vector(x, y)
+		if not self.headless:
+			planet = asset("planet.png")
+			self.planet_sprite = sprite.Sprite(planet, x, y, batch=self.batch, group=self.world_ui)
 		self.win_box = BB(x-200, y-200, x+200, y+200)
 
-		#self.tools = sorted([tool(self.space) for tool in Tool.__subclasses__()], key=attrgetter("order"), reverse=True)
+		#self.tools = sorted([tool(self.space, self.remote) for tool in Tool.__subclasses__()], key=attrgetter("order"), reverse=True)
 		#self.buttons = {tool: Button(30, 30+number*50, tool.image, tool.description, self.use_tool(tool), self.ui, self.batch) for number, tool in enumerate(self.tools)}
 
-		self.constraints = set()
+		self.lines = None if self.headless else ConstraintRenderer(self.batch, self.foreground)
+		self.constraints = Joints(self.space, self.lines)
+
+		if self.saved:
+			snapshot.restore(self, *self.saved)
+			self.saved = None
+		self.saves = []
+
+		if not self.headless:
+			self.timestep.bodies = lambda: self.space.bodies
+
+		self.remote = None
+		if Main.REMOTE_PHYSICS:
+			self.remote = self.constraints.remote = RemotePhysics(self)
+
+		self.profiler = profiler.NULL
+		self.overlay = None
+		if Main.PROFILE:
+			self.toggle_profiler()
+
+	def toggle_profiler(self):
+		if self.profiler.enabled:
+			self.profiler = profiler.NULL
+			self.overlay = None
+			return
+		self.profiler = profiler.Profiler(Main.PHASES, path=Main.PROFILE_DUMP)
+		if not self.headless:
+			self.overlay = text.Label("", font_size=10, x=10, y=self.size.height-10, anchor_y="top",
+				width=self.size.width, multiline=True, font_name="monospace")
 
 	def use_tool(self, tool):
 		"""For callback usage."""
@@ -242,6 +407,15 @@ class Main(Scene):
 
 	def key_pressed(self, symbol, modifiers):
 		self.fade = True
+		if symbol == window.key.F5:
+			self.saves.append(snapshot.save(self, Main.QUICKSAVE))
+		elif symbol == window.key.F9 and os.path.exists(Main.QUICKSAVE):
+			for saving in self.saves:
+				saving.join()
+			self.saved_or_failed()
+			self.end(Main(snapshot=Main.QUICKSAVE))
+		elif symbol == window.key.F3:
+			self.toggle_profiler()
 		#self.camera.key_pressed(symbol)
 
 	def key_released(self, symbol, modifiers):
@@ -255,12 +429,12 @@ class Main(Scene):
 		#		button.callback()
 		#		return
 		if self.selecting:
-			for asteroid in self.asteroids:
-				clicked = self.camera.translate(x, y)
-				if asteroid.point_over(*clicked):
-					self.selection.append((asteroid, clicked))
-					self.tool = self.tool.selection(self.selection, self.constraints)
-					return
+			clicked = self.camera.translate(x, y)
+			asteroid = self.index.at(*clicked)
+			if asteroid:
+				self.selection.append((asteroid, clicked))
+				self.tool = self.tool.selection(self.selection, self.constraints)
+				return
 			self.tool = None
 			return
 
@@ -276,35 +450,108 @@ class Main(Scene):
 		if buttons & window.mouse.RIGHT:
 			self.camera.mouse_dragged(dx, dy)
 
+	def saved_or_failed(self):
+		"""Report any quicksave written in the background that failed, once it
+		is done.
+		"""
+		for saving in [saving for saving in self.saves if not saving.is_alive()]:
+			if saving.error:
+				print("Couldn't quicksave to "+saving.path+": "+str(saving.error[1]))
+			self.saves.remove(saving)
+
 	def update(self, frame_time):
-		self.constraints = {constraint for constraint in self.constraints if not constraint.update(self.batch, self.foreground)}
-		if self.fade and not self.faded:
-			self.logo.opacity -= Main.FADE_SPEED*frame_time
-			if self.logo.opacity < 0:
-				self.logo.opacity = 0
-				del self.logo
-				self.faded = True
-		self.player.target = self.mouse
-		self.player.update()
-		x, y = self.player.body.position
-		self.camera.x, self.camera.y = x-self.size.width/2, y-self.size.height/2
-		self.camera.update(frame_time)
-		self.space.step(1/60)
-		if self.win_box.contains_vect(self.player.body.position):
-			self.end(Win())
+		profile = self.profiler
+		profile.frame()
+		self.saved_or_failed()
+		with profile.phase("fade"):
+			if self.fade and not self.faded:
+				self.logo.opacity -= Main.FADE_SPEED*frame_time
+				if self.logo.opacity < 0:
+					self.logo.opacity = 0
+					del self.logo
+					self.faded = True
+		if self.remote:
+			with profile.phase("space.step"):
+				self.remote.update()
+			blend = self.remote
+			self.follow()
+		else:
+			self.timestep.advance(frame_time, self.tick, self.step_space)
+			blend = self.timestep
+		with profile.phase("camera"):
+			x, y, _ = interpolate(self.player.body, blend)
+			self.camera.x, self.camera.y = x-self.size.width/2, y-self.size.height/2
+			self.camera.update(frame_time)
+			self.stars.update(self.camera)
+		if self.renderer:
+			with profile.phase("render"):
+				self.player.group.blend = blend
+				bounds = self.camera.bounds()
+				self.renderer.update(self.index.within(*bounds), blend)
+				self.lines.update(bounds, blend)
+				self.planet_sprite.visible = self.camera.in_view(self.planet.x, self.planet.y, self.planet_sprite.height)
+			if self.overlay and not profile.frames % 30:
+				self.overlay.text = "\n".join(profile.report())
+
+	def tick(self):
+		"""Game logic that happens once every fixed step, before the physics
+		is stepped. Anything that changes the simulation belongs here rather
+		than in :func:`update`, so it depends only on the steps taken and the
+		input received, and replays exactly.
+		"""
+		profile = self.profiler
+		self.follow()
+		with profile.phase("person"):
+			self.player.target = self.mouse
+			self.crowd.update()
+
+	def follow(self):
+		"""Stream the belt in around the player, and check if they've won."""
+		profile = self.profiler
+		position = self.player.body.position
+		with profile.phase("chunks"):
+			self.chunks.update(*position)
+		with profile.phase("win"):
+			if not self.next and self.win_box.contains_vect(position):
+				self.end(Win(self.world_size, self.star_seed))
+
+	def end(self, next=True):
+		if self.remote:
+			self.remote.stop()
+		super(Main, self).end(next)
+
+	def step_space(self, time):
+		with self.profiler.phase("space.step"):
+			self.space.step(time)
+		with self.profiler.phase("constraints"):
+			self.constraints.check()
 
 	def draw(self):
-		self.batch.draw()
+		with self.profiler.phase("draw"):
+			self.batch.draw()
+		if self.overlay:
+			self.overlay.draw()
 
 class Win(Scene):
 
+	def __init__(self, star_size=Size(2000, 2000), star_seed=None):
+		"""
+		:param star_size: The size of the starfield behind the logo.
+		:param star_seed: The seed of the starfield - pass the belt's size and
+		                  star seed to show the stars it was played under,
+		                  which are already generated.
+		"""
+		self.star_size = star_size
+		self.star_seed = star_seed
+
 	def load(self):
-		self.batch = graphics.Batch()
+		self.batch = None if self.headless else graphics.Batch()
 		self.background = graphics.OrderedGroup(0)
-		self.stars = Stars(Size(2000, 2000), self.batch, self.background)
-		centre = Vector(self.size.width/2, self.size.height/2)
-		image = centre_image(resource.image("win.png"))
-		self.logo = sprite.Sprite(image, centre.x, centre.y)
+		self.stars = Stars(self.star_size, self.batch, self.background, self.star_seed)
+		if not self.headless:
+			centre = Vector(self.size.width/2, self.size.height/2)
+			image = asset("win.png")
+			self.logo = sprite.Sprite(image, centre.x, centre.y)
 
 	def update(self, frame_time):
 		pass
@@ -316,7 +563,7 @@ class Win(Scene):
 	def mouse_pressed(self, x, y, button, modifiers):
 		self.end(True)
 
-	def key_pressed(self, x, y, symbol, modifiers):
+	def key_pressed(self, symbol, modifiers):
 		self.end(True)
 
 	def mouse_motion(self, x, y, dx, dy):
@@ -0,0 +1,217 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+Saving and loading belts.
+
+A snapshot is a small JSON header followed by raw, aligned arrays, so loading
+one just memory-maps the file and takes views of it. The layout of the whole
+belt is saved, along with the state of every asteroid that has been created,
+the joints between them and the player.
+"""
+
+from __future__ import division
+
+import os
+import sys
+import json
+import struct
+import tempfile
+import threading
+
+import numpy
+
+import generation
+from entities import Strut
+from entities import Umbilical
+
+MAGIC = b"ASTEROIDBELT"
+VERSION = 1
+ALIGNMENT = 16
+
+JOINTS = [Strut, Umbilical]
+
+class SnapshotError(Exception):
+	pass
+
+def capture(scene):
+	"""Copy the state of a :class:`scenes.Main` into a header and arrays.
+	This has to happen on the main thread, but is quick - writing the result
+	out can happen elsewhere.
+	"""
+	layout = scene.layout
+	arrays = {"layout."+field: getattr(layout, field) for field in generation.Layout.FIELDS}
+	arrays["meshes.counts"] = layout.pool.counts
+	arrays["meshes.points"] = layout.pool.points
+	asteroids = list(scene.chunks)
+	rows = scene.store.rows(asteroids)
+	arrays["asteroids.ids"] = scene.store.ids[rows]
+	arrays["asteroids.state"] = numpy.array([body_state(asteroid.body) for asteroid in asteroids], dtype=numpy.float64).reshape(-1, 6)
+	arrays["asteroids.populated"] = scene.store.populated[rows].astype(numpy.uint8)
+	joints = list(scene.constraints)
+	arrays["joints.kinds"] = numpy.array([JOINTS.index(type(joint)) for joint in joints], dtype=numpy.uint8)
+	arrays["joints.asteroids"] = numpy.array([[asteroid.id for asteroid in joint.asteroids] for joint in joints], dtype=numpy.int64).reshape(-1, 2)
+	arrays["joints.anchors"] = numpy.array([tuple(joint.constraint.anchr1)+tuple(joint.constraint.anchr2) for joint in joints], dtype=numpy.float64).reshape(-1, 4)
+	arrays["player.state"] = numpy.array(body_state(scene.player.body), dtype=numpy.float64)
+	header = {
+		"seed": scene.seed,
+		"star_seed": scene.star_seed,
+		"world_size": list(scene.world_size),
+		"home": layout.home,
+	}
+	return header, {name: numpy.array(array) for name, array in arrays.items()}
+
+def body_state(body):
+	x, y = body.position
+	vx, vy = body.velocity
+	return x, y, vx, vy, body.angle, body.angular_velocity
+
+def set_body_state(body, state):
+	x, y, vx, vy, angle, angular_velocity = state
+	body.position = x, y
+	body.velocity = vx, vy
+	body.angle = angle
+	body.angular_velocity = angular_velocity
+
+def write(path, header, arrays):
+	header = dict(header)
+	header["arrays"] = specs = {}
+	offset = 0
+	for name in sorted(arrays):
+		array = numpy.ascontiguousarray(arrays[name])
+		arrays[name] = array
+		specs[name] = [array.dtype.str, list(array.shape), offset]
+		offset = _aligned(offset+array.nbytes)
+	encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+	# Written alongside and moved into place, so a save being written in the
+	# background is never read half done. Each save has its own temporary
+	# file, so saves can't write over each other.
+	handle, temporary = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path)+".", dir=os.path.dirname(path) or ".")
+	try:
+		with os.fdopen(handle, "wb") as file:
+			_write(file, encoded, arrays)
+		_replace(temporary, path)
+	except Exception:
+		if os.path.exists(temporary):
+			os.remove(temporary)
+		raise
+
+def _write(file, encoded, arrays):
+	file.write(MAGIC)
+	file.write(struct.pack("<II", VERSION, len(encoded)))
+	file.write(encoded)
+	start = len(MAGIC)+8+len(encoded)
+	file.write(b"\0"*(_aligned(start)-start))
+	for name in sorted(arrays):
+		data = arrays[name].tobytes()
+		file.write(data)
+		file.write(b"\0"*(_aligned(len(data))-len(data)))
+
+class Saving(threading.Thread):
+	"""A snapshot being written in the background. Saves to the same path are
+	written in the order they were made. If writing fails, :attr:`error` is
+	the ``sys.exc_info()`` of the failure once the thread is done.
+	"""
+
+	_last = {}
+
+	def __init__(self, path, header, arrays):
+		super(Saving, self).__init__()
+		self.path = path
+		self.header = header
+		self.arrays = arrays
+		self.error = None
+		self.previous = Saving._last.get(path)
+		Saving._last[path] = self
+
+	def run(self):
+		if self.previous:
+			self.previous.join()
+			self.previous = None
+		try:
+			write(self.path, self.header, self.arrays)
+		except Exception:
+			self.error = sys.exc_info()
+
+def save(scene, path, background=True):
+	"""Save the scene to the given path. The state is captured immediately,
+	but by default written on a background thread - the :class:`Saving` is
+	returned, so whether it worked can be checked once it is done.
+	"""
+	header, arrays = capture(scene)
+	if not background:
+		write(path, header, arrays)
+		return None
+	thread = Saving(path, header, arrays)
+	thread.start()
+	return thread
+
+def read(path):
+	"""Memory-map a snapshot, returning its header and views of its arrays."""
+	data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+	if bytes(data[:len(MAGIC)].tobytes()) != MAGIC:
+		raise SnapshotError(path+" is not a snapshot.")
+	version, length = struct.unpack("<II", data[len(MAGIC):len(MAGIC)+8].tobytes())
+	if version != VERSION:
+		raise SnapshotError(path+" is a version "+str(version)+" snapshot, expected version "+str(VERSION)+".")
+	start = len(MAGIC)+8
+	header = json.loads(data[start:start+length].tobytes().decode("utf-8"))
+	start = _aligned(start+length)
+	arrays = {}
+	for name, (dtype, shape, offset) in header.pop("arrays").items():
+		dtype = numpy.dtype(str(dtype))
+		count = int(numpy.prod(shape))
+		begin = start+offset
+		arrays[name] = data[begin:begin+count*dtype.itemsize].view(dtype).reshape(shape)
+	return header, arrays
+
+def layout(header, arrays):
+	"""The :class:`generation.Layout` saved in a snapshot."""
+	pool = generation.MeshPool(arrays["meshes.counts"], arrays["meshes.points"])
+	return generation.Layout(pool, *(arrays["layout."+field] for field in generation.Layout.FIELDS), home=header["home"])
+
+def restore(scene, header, arrays):
+	"""Put the saved asteroids, joints and player into a freshly loaded
+	:class:`scenes.Main`, whose layout came from :func:`layout`.
+	"""
+	for i, state, populated in zip(arrays["asteroids.ids"].tolist(), arrays["asteroids.state"], arrays["asteroids.populated"].tolist()):
+		asteroid = scene.chunks.asteroid(i)
+		set_body_state(asteroid.body, state.tolist())
+		asteroid.populated = bool(populated)
+	for kind, (a, b), anchors in zip(arrays["joints.kinds"].tolist(), arrays["joints.asteroids"].tolist(), arrays["joints.anchors"].tolist()):
+		asteroid_1, asteroid_2 = scene.chunks.asteroid(a), scene.chunks.asteroid(b)
+		scene.constraints.add(JOINTS[kind](asteroid_1, asteroid_2, tuple(anchors[:2]), tuple(anchors[2:]), scene.space))
+	set_body_state(scene.player.body, arrays["player.state"].tolist())
+	# Every saved asteroid's chunk was activated to restore it - forget where
+	# the player was, so all but those around the player are frozen again.
+	scene.chunks.centre = None
+	scene.chunks.update(*scene.player.body.position)
+
+def _replace(source, destination):
+	"""Rename a file over another - os.rename won't on Windows."""
+	if hasattr(os, "replace"):
+		os.replace(source, destination)
+	else:
+		if os.name == "nt" and os.path.exists(destination):
+			os.remove(destination)
+		os.rename(source, destination)
+
+def _aligned(offset):
+	return (offset+ALIGNMENT-1)//ALIGNMENT*ALIGNMENT
@@ -22,20 +22,24 @@ Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
 In-game tools.
 """
 
-from pyglet import resource
 from pyglet import window
 
-from graphics import centre_image
+from graphics import asset
 import entities
 from physics import Vector
 
 class Tool(object):
-	def __init__(self, order, name, description, space):
+	def __init__(self, order, name, description, space, remote=None):
+		"""
+		:param remote: The scene's :class:`remote.RemotePhysics`, if the
+		               physics is running in another process.
+		"""
 		self.order = order
 		self.name = name
 		self.description = description
-		self.image = centre_image(resource.image(self.name.lower()+".png"))
+		self.image = asset(self.name.lower()+".png")
 		self.space = space
+		self.remote = remote
 
 	def selection(self, selection, constraints):
 		raise NotImplementedError
@@ -96,7 +100,12 @@ class Rocket(Tool):
 		asteroid, position = selection[0]
 		vec = asteroid.position-Vector(*position)
 		mag = vec.magnitude
-		asteroid.body.apply_impulse(vec*(1/mag)*1000, (0, 0))
+		impulse = vec*(1/mag)*1000
+		if self.remote:
+			self.remote.impulse(asteroid, impulse)
+			return None
+		asteroid.body.activate()
+		asteroid.body.apply_impulse(impulse, (0, 0))
 		return None
 
 class Nuke(Tool):
@@ -0,0 +1,172 @@
+#!/usr/bin/env python2
+# -*- coding: UTF-8 -*-
+
+"""
+Copyright © 2012: Gareth Latty <gareth@lattyware.co.uk>
+
+    This file is part of Asteroid Belt.
+
+    Asteroid Belt is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Asteroid Belt is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Asteroid Belt. If not, see <http://www.gnu.org/licenses/>.
+
+Streaming the belt in and out around the player.
+"""
+
+from __future__ import division
+
+from itertools import chain
+from collections import defaultdict
+
+import numpy
+
+from entities import Asteroid
+from entities import EntityStore
+
+class Chunks(object):
+	"""Splits a belt's layout into square chunks, so only the region around
+	the player is ever in the space.
+
+	The asteroids in a chunk are created the first time the player comes
+	near. When the player moves far away the chunk is frozen - its asteroids
+	(and any joints on them) are taken out of the space, the index and the
+	renderer, but keep their bodies, and so their state, until the player
+	comes back. Asteroids start in the chunk they were laid out in, and move
+	to the chunk they have drifted into whenever chunks are frozen, and every
+	so often otherwise, so they are frozen and thawed with the part of the
+	belt they are actually in.
+	"""
+
+	SIZE = 2048
+	REFRESH = 60
+
+	def __init__(self, layout, space, index, renderer, batch, group, size=SIZE, near=1, far=2, store=None, refresh=REFRESH):
+		"""
+		:param index: The :class:`physics.SpatialIndex` asteroids are added to.
+		:param renderer: The :class:`entities.AsteroidRenderer`, or None.
+		:param near: Chunks within this many chunks of the player are active.
+		:param far: Active chunks are frozen once they are further away than
+		            this, so crossing a boundary back and forth doesn't churn.
+		:param store: The :class:`entities.EntityStore` asteroids are kept in -
+		              a new one if not given.
+		:param refresh: While the player stays in one chunk, asteroids that
+		                have drifted are moved between chunks (and frozen, if
+		                they have left the active ones) every this many
+		                updates.
+		"""
+		self.layout = layout
+		self.space = space
+		self.index = index
+		self.renderer = renderer
+		self.batch = batch
+		self.group = group
+		self.size = size
+		self.near = near
+		self.far = far
+		self.store = store if store is not None else EntityStore()
+		# Where the bodies start - asteroids are laid out by their centres, but
+		# their bodies are placed half their size down and left of that.
+		x, y = layout.x-layout.sizes/2, layout.y-layout.sizes/2
+		self.keys = dict(enumerate(zip((x//size).astype(int).tolist(), (y//size).astype(int).tolist())))
+		self.members = defaultdict(set)
+		for i, key in self.keys.items():
+			self.members[key].add(i)
+		self.asteroids = {}
+		self.live = {}
+		self.active = set()
+		self.centre = None
+		self.refresh = refresh
+		self.updates = 0
+
+	def chunk(self, x, y):
+		return int(x//self.size), int(y//self.size)
+
+	def asteroid(self, i):
+		"""The asteroid at the given layout index, activating its chunk if it
+		has never been created.
+		"""
+		if i not in self.asteroids:
+			self.activate([self.keys[i]])
+		return self.asteroids[i]
+
+	def __iter__(self):
+		"""Every asteroid that exists, active or frozen."""
+		return iter(self.asteroids.values())
+
+	def update(self, x, y):
+		"""Activate the chunks near the given position and freeze those far
+		from it. Cheap unless the position has moved into another chunk, or
+		it is time to catch up with drifting asteroids.
+		"""
+		self.updates += 1
+		cx, cy = centre = self.chunk(x, y)
+		if centre == self.centre:
+			if not self.updates % self.refresh:
+				self.freeze(())
+			return
+		self.centre = centre
+		near = {(cx+dx, cy+dy) for dx in range(-self.near, self.near+1) for dy in range(-self.near, self.near+1)}
+		self.activate(near-self.active)
+		self.freeze({key for key in self.active if max(abs(key[0]-cx), abs(key[1]-cy)) > self.far})
+
+	def rechunk(self):
+		"""Move every active asteroid into the chunk it has drifted into.
+		Frozen asteroids don't move, so they are always where they were left.
+		"""
+		for i, asteroid in self.live.items():
+			key = self.chunk(*asteroid.body.position)
+			if key != self.keys[i]:
+				self.members[self.keys[i]].discard(i)
+				self.members[key].add(i)
+				self.keys[i] = key
+
+	def activate(self, keys):
+		keys = [key for key in keys if key not in self.active]
+		self.active.update(keys)
+		members = [i for key in keys for i in self.members.get(key, ())]
+		new = [i for i in members if i not in self.asteroids]
+		if new:
+			for asteroid in Asteroid.build(self.layout, self.batch, self.group, self.space, numpy.array(new), self.store):
+				self.asteroids[asteroid.id] = asteroid
+		thawed = [self.asteroids[i] for i in members if i not in self.live and i not in new]
+		if thawed:
+			self.space.add(*chain.from_iterable((asteroid.body, asteroid.shape) for asteroid in thawed))
+		asteroids = [self.asteroids[i] for i in members if i not in self.live]
+		for asteroid in asteroids:
+			asteroid.active = True
+			self.live[asteroid.id] = asteroid
+			self.index.add(asteroid)
+		for asteroid in thawed:
+			for joint in asteroid.joints:
+				joint.thaw()
+		if self.renderer and asteroids:
+			self.renderer.add(asteroids)
+
+	def freeze(self, keys):
+		"""Freeze the given chunks, along with any asteroid that has drifted
+		out of the active chunks.
+		"""
+		self.active.difference_update(keys)
+		self.rechunk()
+		asteroids = [asteroid for i, asteroid in self.live.items() if self.keys[i] not in self.active]
+		if not asteroids:
+			return
+		for asteroid in asteroids:
+			for joint in asteroid.joints:
+				joint.freeze()
+			asteroid.active = False
+			asteroid.body.activate()
+			self.index.remove(asteroid)
+			del self.live[asteroid.id]
+		self.space.remove(*chain.from_iterable((asteroid.body, asteroid.shape) for asteroid in asteroids))
+		if self.renderer:
+			self.renderer.remove(asteroids)